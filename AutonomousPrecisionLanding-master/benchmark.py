@@ -0,0 +1,144 @@
+'''
+
+	Synopsis: Reproducible detector benchmark. Frames are rendered with sim.simulate_target
+	over a grid of altitudes, offsets and attitudes, fed to the detector, and speed
+	(frames/s, latency distribution) is reported together with accuracy (center
+	error against the projected ground truth, miss rate) as JSON.
+
+'''
+
+#Python Imports
+import argparse
+import itertools
+import json
+import os
+import time
+
+#Opencv Imports
+import numpy as np
+
+#Dronekit Imports
+from dronekit import LocationGlobalRelative, Attitude
+
+#Common Library Imports
+import detectors
+import search_image
+import sim
+
+def render_grid(altitudes, offsets, angles, yaws):
+	'''
+	Yield (case, frame, center, corners) for every grid point. center and corners
+	are the ground truth in camera image pixels.
+	'''
+	ppm = sim.pixels_per_meter
+	for alt, north, east, pitch, roll, yaw in itertools.product(altitudes, offsets, offsets, angles, angles, yaws):
+		args = (pitch, roll, yaw, north * ppm, east * ppm, 0, 0, 0, alt * ppm,
+		        sim.camera_height, sim.camera_width, sim.camera_fov)
+		M = sim.target_transform(*args)
+		center, corners = sim.target_ground_truth(M)
+		frame = sim.simulate_target(*args)
+		case = {"alt": alt, "north": north, "east": east, "pitch": pitch, "roll": roll, "yaw": yaw}
+		yield case, frame, center, corners
+
+def percentiles(values):
+	if len(values) == 0:
+		return {"count": 0}
+	values = np.asarray(values, dtype=np.float64)
+	p50, p95, p99 = np.percentile(values, [50, 95, 99])
+	return {"count": len(values), "mean": round(float(values.mean()), 3), "p50": round(float(p50), 3),
+	        "p95": round(float(p95), 3), "p99": round(float(p99), 3), "max": round(float(values.max()), 3)}
+
+def run(altitudes, offsets, angles, yaws, detector, vehicle_state=True):
+	'''
+	With vehicle_state the detector also gets the simulated location and
+	attitude, as it would in flight.
+	'''
+	latencies = []
+	errors = []
+	visible = missed = false_positives = 0
+	per_altitude = {}
+	for case, frame, center, corners in render_grid(altitudes, offsets, angles, yaws):
+		location = attitude = None
+		if vehicle_state:
+			location = LocationGlobalRelative(0, 0, case["alt"])
+			attitude = Attitude(case["pitch"], case["yaw"], case["roll"])
+		begin = time.perf_counter()
+		detection = detector.detect(frame, location, attitude)
+		latencies.append((time.perf_counter() - begin) * 1000.0)
+		found = detection.center
+
+		in_view = bool(np.all((corners >= 0) & (corners < (sim.camera_width, sim.camera_height))))
+		stats = per_altitude.setdefault(case["alt"], {"visible": 0, "missed": 0, "errors": []})
+		if in_view:
+			visible += 1
+			stats["visible"] += 1
+			if found is None:
+				missed += 1
+				stats["missed"] += 1
+			else:
+				# search_image reports centers relative to the middle of the image, y up
+				truth = search_image.image_center(center[0], center[1], frame.shape)
+				error = float(np.hypot(found[0] - truth[0], found[1] - truth[1]))
+				errors.append(error)
+				stats["errors"].append(error)
+		elif found is not None:
+			false_positives += 1
+
+	total = sum(latencies) / 1000.0
+	return {
+		"frames": len(latencies),
+		"visible": visible,
+		"throughput_fps": round(len(latencies) / total, 2) if total > 0 else None,
+		"latency_ms": percentiles(latencies),
+		"center_error_px": percentiles(errors),
+		"miss_rate": round(missed / float(visible), 4) if visible else None,
+		"false_positives": false_positives,
+		"per_altitude": dict((str(alt), {
+			"visible": s["visible"],
+			"miss_rate": round(s["missed"] / float(s["visible"]), 4) if s["visible"] else None,
+			"center_error_px": percentiles(s["errors"])}) for alt, s in sorted(per_altitude.items())),
+	}
+
+if __name__ == "__main__":
+	floats = lambda text: [float(v) for v in text.split(",")]
+	parser = argparse.ArgumentParser(
+		description='Benchmark target detection speed and accuracy on simulated frames.')
+	parser.add_argument(
+		'--altitudes', type=floats, default=[5, 10, 15, 20, 25], help="Comma separated altitudes in metres.")
+	parser.add_argument(
+		'--offsets', type=floats, default=[-2, 0, 2], help="Comma separated north/east target offsets in metres.")
+	parser.add_argument(
+		'--angles', type=floats, default=[-0.1, 0, 0.1], help="Comma separated pitch/roll angles in radians.")
+	parser.add_argument(
+		'--yaws', type=floats, default=[0, 0.5], help="Comma separated yaw angles in radians.")
+	parser.add_argument(
+		'--detector', choices=detectors.available(), default='haar', help="Detection backend to benchmark.")
+	parser.add_argument(
+		'--coarse', type=int, choices=[2, 4], help="Cascade detectors: coarse-to-fine search factor.")
+	parser.add_argument(
+		'--background', action='store_true', help="Render the target over Resources/bg.jpg instead of a flat colour.")
+	parser.add_argument(
+		'--no-vehicle-state', action='store_true', help="Do not pass altitude and attitude to the detector.")
+	parser.add_argument(
+		'--label', default="", help="Free-form label stored with the results, e.g. a commit id.")
+	parser.add_argument(
+		'--output', default=(os.path.dirname(os.path.realpath(__file__)))+'/Logs/benchmark.json', help="Result file.")
+	args = parser.parse_args()
+
+	sim.load_target(sim.filename, sim.target_size)
+	if args.background:
+		sim.load_background()
+	options = {"coarse": args.coarse} if args.coarse else {}
+	results = run(args.altitudes, args.offsets, args.angles, args.yaws, detectors.create(args.detector, **options),
+	              vehicle_state=not args.no_vehicle_state)
+	results["detector"] = args.detector
+	results["options"] = options
+	results["background"] = args.background
+	results["label"] = args.label
+	results["grid"] = {"altitudes": args.altitudes, "offsets": args.offsets, "angles": args.angles, "yaws": args.yaws}
+	with open(args.output, "w") as f:
+		json.dump(results, f, indent=1, sort_keys=True)
+
+	print("%d frames, %.1f frames/s, latency p50 %.1f ms p95 %.1f ms, miss rate %s, center error p50 %s px" % (
+		results["frames"], results["throughput_fps"], results["latency_ms"]["p50"], results["latency_ms"]["p95"],
+		results["miss_rate"], results["center_error_px"].get("p50")))
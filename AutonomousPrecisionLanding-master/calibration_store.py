@@ -0,0 +1,99 @@
+'''
+
+	Synopsis: Versioned camera calibration file. OpencvScripts/calibration.py writes it,
+	the flight code and the scripts read it through one cached loader and get the
+	intrinsics rescaled to whatever resolution they process frames at. A file that
+	does not record the resolution it was made at (image_size null) cannot be
+	rescaled, asking it for intrinsics raises ValueError.
+
+'''
+
+#Python Imports
+import collections
+import functools
+import json
+import os
+import time
+
+#Opencv Imports
+import numpy as np
+
+version = 1
+aspect_tolerance = 0.01 #relative difference in width/height accepted when rescaling
+calibration_file = (os.path.dirname(os.path.realpath(__file__)))+'/Resources/camera_calibration.json'
+
+Calibration = collections.namedtuple("Calibration", ("camera_matrix", "dist_coeffs", "image_size", "rms"))
+
+def save(camera_matrix, dist_coeffs, image_size, rms=None, path=calibration_file):
+	'''
+	Write a calibration made at image_size (width, height). rms is the
+	reprojection error cv2.calibrateCamera reported.
+	'''
+	if image_size is None:
+		raise ValueError("A calibration is only usable with the image size it was made at")
+	data = {
+		"version": version,
+		"created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		"image_size": [int(image_size[0]), int(image_size[1])],
+		"camera_matrix": np.asarray(camera_matrix, dtype=np.float64).reshape(3, 3).tolist(),
+		"dist_coeffs": np.asarray(dist_coeffs, dtype=np.float64).ravel().tolist(),
+		"rms": None if rms is None else float(rms),
+	}
+	with open(path, "w") as f:
+		json.dump(data, f, indent=1)
+	load.cache_clear()
+	intrinsics.cache_clear()
+
+@functools.lru_cache(maxsize=None)
+def load(path=calibration_file):
+	'''
+	Read a calibration file once. The arrays are shared between callers and
+	read-only.
+	'''
+	with open(path) as f:
+		data = json.load(f)
+	if data.get("version") != version:
+		raise ValueError("Unsupported calibration version %s in %s" % (data.get("version"), path))
+	camera_matrix = np.array(data["camera_matrix"], dtype=np.float64).reshape(3, 3)
+	dist_coeffs = np.array(data["dist_coeffs"], dtype=np.float64)
+	camera_matrix.flags.writeable = False
+	dist_coeffs.flags.writeable = False
+	image_size = data.get("image_size")
+	if image_size is not None:
+		image_size = tuple(image_size)
+	return Calibration(camera_matrix, dist_coeffs, image_size, data.get("rms"))
+
+def scale_intrinsics(camera_matrix, from_size, to_size):
+	'''
+	Camera matrix for frames resized from from_size to to_size (width, height).
+	Focal lengths and principal point scale with the image, distortion
+	coefficients are unchanged. Resizing to another aspect ratio would
+	stretch the image and change every pose computed from it, so that raises
+	ValueError; crop to the calibrated aspect or calibrate at that size. So
+	does a principal point outside the frame, which means camera_matrix was
+	not made at from_size.
+	'''
+	from_aspect = from_size[0] / float(from_size[1])
+	to_aspect = to_size[0] / float(to_size[1])
+	if abs(to_aspect / from_aspect - 1) > aspect_tolerance:
+		raise ValueError("Calibration made at %dx%d does not fit %dx%d frames, the aspect ratio differs" % (
+			from_size[0], from_size[1], to_size[0], to_size[1]))
+	scaled = np.array(camera_matrix, dtype=np.float64)
+	scaled[0] *= to_size[0] / float(from_size[0])
+	scaled[1] *= to_size[1] / float(from_size[1])
+	if not (0 < scaled[0, 2] < to_size[0] and 0 < scaled[1, 2] < to_size[1]):
+		raise ValueError("Principal point (%.1f, %.1f) is outside %dx%d frames, the calibration was not made at %dx%d" % (
+			scaled[0, 2], scaled[1, 2], to_size[0], to_size[1], from_size[0], from_size[1]))
+	return scaled
+
+@functools.lru_cache(maxsize=None)
+def intrinsics(size, path=calibration_file):
+	'''
+	(camera_matrix, dist_coeffs) for frames of size (width, height).
+	'''
+	calibration = load(path)
+	if calibration.image_size is None:
+		raise ValueError("%s does not record the image size it was made at, recalibrate with OpencvScripts/calibration.py" % path)
+	camera_matrix = scale_intrinsics(calibration.camera_matrix, calibration.image_size, size)
+	camera_matrix.flags.writeable = False
+	return camera_matrix, calibration.dist_coeffs
@@ -0,0 +1,87 @@
+'''
+
+	Synopsis: Lens model of the landing camera. Frames can be rectified with remap
+	tables built once per resolution, or, much cheaper, only the detected points are
+	undistorted.
+
+'''
+
+#Opencv Imports
+import cv2
+import numpy as np
+
+#Common Library Imports
+import calibration_store
+
+modes = ("none", "points", "rectify")
+# field of view of the landing camera's lens in degrees. The simulator renders with
+# it, search_image predicts the target size and control converts pixels to metres with it
+hfov = 49.7
+vfov = 48.7
+
+class CameraModel(object):
+	'''
+	camera_matrix and dist_coeffs as returned by cv2.calibrateCamera at
+	calibration_size (width, height). Frames of any other size are handled by
+	scaling the intrinsics, the distortion coefficients do not depend on it.
+	'''
+
+	def __init__(self, camera_matrix, dist_coeffs, calibration_size):
+		self.camera_matrix = np.asarray(camera_matrix, dtype=np.float64)
+		self.dist_coeffs = np.asarray(dist_coeffs, dtype=np.float64)
+		if calibration_size is None:
+			raise ValueError("The camera model needs the image size the calibration was made at, recalibrate with OpencvScripts/calibration.py")
+		self.calibration_size = tuple(calibration_size)
+		self.matrices = {}
+		self.maps = {}
+
+	def matrix(self, size):
+		'''
+		Camera matrix for frames of size (width, height).
+		'''
+		size = tuple(size)
+		if size not in self.matrices:
+			self.matrices[size] = calibration_store.scale_intrinsics(self.camera_matrix, self.calibration_size, size)
+		return self.matrices[size]
+
+	def rectify_maps(self, size):
+		'''
+		remap tables for frames of size (width, height), built on first use.
+		The rectified frame keeps the same camera matrix, so pixel scales (and
+		search_image's expected target size) are unchanged.
+		'''
+		size = tuple(size)
+		if size not in self.maps:
+			matrix = self.matrix(size)
+			self.maps[size] = cv2.initUndistortRectifyMap(matrix, self.dist_coeffs, None, matrix, size, cv2.CV_16SC2)
+		return self.maps[size]
+
+	def remap(self, img, out=None):
+		'''
+		Rectify a whole frame. out must not be img.
+		'''
+		map1, map2 = self.rectify_maps((img.shape[1], img.shape[0]))
+		return cv2.remap(img, map1, map2, cv2.INTER_LINEAR, dst=out)
+
+	def undistort_points(self, points, size):
+		'''
+		Undistort (N, 2) pixel coordinates of a frame of size (width, height).
+		Returns (N, 2) pixel coordinates in the rectified frame.
+		'''
+		matrix = self.matrix(size)
+		points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+		return cv2.undistortPoints(points, matrix, self.dist_coeffs, P=matrix).reshape(-1, 2)
+
+	def undistort_center(self, center, shape):
+		'''
+		Undistort a target center in the search_image convention (relative to
+		the middle of the image, y up) whose pixels are those of a frame of the
+		given shape; for detections that is search_image's reference frame.
+		'''
+		height, width = shape[:2]
+		x, y = self.undistort_points([(center[0] + width / 2.0, height / 2.0 - center[1])], (width, height))[0]
+		return (x - width / 2.0, height / 2.0 - y)
+
+def default_model(path=calibration_store.calibration_file):
+	calibration = calibration_store.load(path)
+	return CameraModel(calibration.camera_matrix, calibration.dist_coeffs, calibration.image_size)
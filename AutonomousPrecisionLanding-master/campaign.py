@@ -0,0 +1,236 @@
+'''
+
+	Synopsis: Monte Carlo landing campaign. Thousands of offline landings with the
+	simulated vehicle and renderer run across all cores, each with its own random
+	target offset, starting altitude, attitude noise, detection dropout and latency,
+	and landing error, time to land and per-frame compute cost are summarised as JSON.
+
+'''
+
+#Python Imports
+import argparse
+import collections
+import json
+import math
+import multiprocessing
+import os
+import time
+
+#Opencv Imports
+import cv2
+import numpy as np
+
+#Dronekit Imports
+from dronekit import VehicleMode, LocationGlobalRelative, Attitude
+
+#Common Library Imports
+from benchmark import percentiles
+from flight_assist import start_setpoint_streamer, stop_setpoint_streamer
+from sim_vehicle import SimVehicle
+import control
+import detectors
+import position_vector
+import sim
+
+frame_period = 0.1 #seconds of simulated time per frame, the rate main.py runs at
+detector = None
+
+def init_worker(name, options, background, render_cache_bytes):
+	global detector
+	# one landing per core already
+	cv2.setNumThreads(1)
+	# thousands of landings, not a line per frame
+	control.verbose = False
+	detector = detectors.create(name, **options)
+	sim.load_target(sim.filename, sim.target_size)
+	if background:
+		sim.load_background()
+	sim.set_realtime(False)
+	# kept for the life of the worker, landings with similar conditions share frames
+	sim.enable_render_cache(render_cache_bytes)
+
+def sample(rng, settings):
+	'''
+	Draw the randomised conditions of one landing.
+	'''
+	return {
+		"north": float(rng.uniform(-settings["max_offset"], settings["max_offset"])),
+		"east": float(rng.uniform(-settings["max_offset"], settings["max_offset"])),
+		"altitude": float(rng.uniform(*settings["altitudes"])),
+		"attitude_noise": float(rng.uniform(0, settings["attitude_noise"])),
+		"dropout": float(rng.uniform(0, settings["dropout"])),
+		"latency": int(rng.integers(0, settings["latency"] + 1)),
+	}
+
+def run_landing(task):
+	'''
+	Fly one landing. The target sits north/east metres from where the vehicle
+	takes off; detections reach control latency frames late and are lost
+	with probability dropout; control sees the attitude with gaussian noise.
+	'''
+	index, seed, settings = task
+	rng = np.random.default_rng([seed, index])
+	conditions = sample(rng, settings)
+
+	vehicle = SimVehicle()
+	control.reset()
+	streamer = start_setpoint_streamer(vehicle, clock=vehicle.clock, threaded=False)
+	home = vehicle.location.global_relative_frame
+	target = LocationGlobalRelative(home.lat + conditions["north"] / position_vector.posvec_latlon_to_m,
+	                                home.lon + conditions["east"] / (position_vector.posvec_latlon_to_m * position_vector.posvec_lon_scale),
+	                                0)
+	sim.set_target_location(target)
+
+	vehicle.mode = VehicleMode("GUIDED")
+	vehicle.armed = True
+	vehicle.simple_takeoff(conditions["altitude"])
+	vehicle.run_until(lambda: vehicle.location.global_relative_frame.alt >= conditions["altitude"] * 0.95)
+	start = vehicle.clock()
+
+	frame = np.empty((sim.camera_height, sim.camera_width, 3), dtype=np.uint8)
+	cache = sim.render_cache.stats() if sim.render_cache is not None else None
+	delayed = collections.deque([None] * conditions["latency"])
+	compute = []
+	detected = 0
+	frames = 0
+	while vehicle.armed and vehicle.mode == "GUIDED" and vehicle.clock() - start < settings["timeout"]:
+		location = vehicle.location.global_relative_frame
+		attitude = vehicle.attitude
+		noise = rng.normal(0, conditions["attitude_noise"], 3)
+		measured = Attitude(attitude.pitch + noise[0], attitude.yaw + noise[1], attitude.roll + noise[2])
+
+		begin = time.perf_counter()
+		sim.refresh_simulator(location, attitude)
+		sim.get_frame(attitude, out=frame)
+		detection = detector.detect(frame, location, measured)
+		center = detection.center
+		if center is not None:
+			detected += 1
+		if rng.random() < conditions["dropout"]:
+			center = None
+		delayed.append(center)
+		control.land(vehicle, delayed.popleft(), measured, location, frame_period)
+		compute.append((time.perf_counter() - begin) * 1000.0)
+
+		streamer.tick()
+		vehicle.step(frame_period)
+		frames += 1
+
+	if vehicle.mode == "LAND":
+		vehicle.run_until(lambda: not vehicle.armed, timeout=settings["timeout"])
+	stop_setpoint_streamer(vehicle)
+
+	north, east, up = vehicle.position
+	result = dict(conditions)
+	if cache is not None:
+		now = sim.render_cache.stats()
+		result["render_hits"] = now["hits"] - cache["hits"]
+		result["render_misses"] = now["misses"] - cache["misses"]
+	result.update({
+		"index": index,
+		"landed": not vehicle.armed,
+		"error_m": math.hypot(north - conditions["north"], east - conditions["east"]),
+		"time_to_land_s": vehicle.clock() - start,
+		"frames": frames,
+		"detected": detected,
+		"compute_ms_mean": float(np.mean(compute)) if compute else None,
+		"compute_ms_p95": float(np.percentile(compute, 95)) if compute else None,
+	})
+	return result, compute
+
+def campaign(runs, settings, jobs=None, seed=0, detector_name="haar", options=None, background=False,
+             render_cache_bytes=0):
+	tasks = [(index, seed, settings) for index in range(runs)]
+	results = []
+	compute = []
+	begin = time.time()
+	initargs = (detector_name, options or {}, background, render_cache_bytes)
+	pool = multiprocessing.Pool(jobs, initializer=init_worker, initargs=initargs)
+	try:
+		for result, frame_ms in pool.imap_unordered(run_landing, tasks, chunksize=4):
+			results.append(result)
+			compute.extend(frame_ms)
+	finally:
+		pool.close()
+		pool.join()
+	elapsed = time.time() - begin
+
+	report = summarise(results, compute)
+	report.update({
+		"wall_s": round(elapsed, 1),
+		"seed": seed,
+		"detector": detector_name,
+		"options": options or {},
+		"background": background,
+		"settings": settings,
+	})
+	report["render_cache"]["bytes"] = render_cache_bytes
+	return report
+
+def summarise(results, compute):
+	'''
+	Landing statistics over the per-landing results of run_landing and the
+	per-frame compute times of all landings. Errors and times to land only
+	count landings that touched down.
+	'''
+	results = sorted(results, key=lambda r: r["index"])
+	landed = [r for r in results if r["landed"]]
+	hits = sum(r.get("render_hits", 0) for r in results)
+	misses = sum(r.get("render_misses", 0) for r in results)
+	return {
+		"runs": len(results),
+		"landed": len(landed),
+		"landed_rate": round(len(landed) / float(len(results)), 4) if results else None,
+		"landing_error_m": percentiles([r["error_m"] for r in landed]),
+		"time_to_land_s": percentiles([r["time_to_land_s"] for r in landed]),
+		"frame_compute_ms": percentiles(compute),
+		"render_cache": {"hits": hits, "misses": misses,
+		                 "hit_rate": round(hits / float(hits + misses), 4) if hits + misses else None},
+		"results": results,
+	}
+
+if __name__ == "__main__":
+	floats = lambda text: [float(v) for v in text.split(",")]
+	parser = argparse.ArgumentParser(
+		description='Run randomised offline landings and summarise landing error, time to land and compute cost.')
+	parser.add_argument(
+		'--runs', type=int, default=1000, help="Number of landings.")
+	parser.add_argument(
+		'--jobs', type=int, default=None, help="Worker processes, defaults to one per core.")
+	parser.add_argument(
+		'--seed', type=int, default=0, help="Campaign seed, run i always gets the same conditions for a given seed.")
+	parser.add_argument(
+		'--max-offset', type=float, default=3.0, help="Target offset north and east is uniform in +-this many metres.")
+	parser.add_argument(
+		'--altitudes', type=floats, default=[8.0, 15.0], help="Starting altitude range in metres, min,max.")
+	parser.add_argument(
+		'--attitude-noise', type=float, default=0.03, help="Upper bound of the attitude noise standard deviation in radians.")
+	parser.add_argument(
+		'--dropout', type=float, default=0.2, help="Upper bound of the probability that a detection is lost.")
+	parser.add_argument(
+		'--latency', type=int, default=3, help="Upper bound of the detection latency in frames.")
+	parser.add_argument(
+		'--timeout', type=float, default=120.0, help="Simulated seconds before a landing is abandoned.")
+	parser.add_argument(
+		'--detector', choices=detectors.available(), default='haar', help="Detection backend.")
+	parser.add_argument(
+		'--coarse', type=int, choices=[2, 4], help="Cascade detectors: coarse-to-fine search factor.")
+	parser.add_argument(
+		'--background', action='store_true', help="Render the target over Resources/bg.jpg instead of a flat colour.")
+	parser.add_argument(
+		'--render-cache', type=int, default=0, help="Megabytes of rendered frames each worker keeps for reuse, 0 renders every frame.")
+	parser.add_argument(
+		'--output', default=(os.path.dirname(os.path.realpath(__file__)))+'/Logs/campaign.json', help="Summary file.")
+	args = parser.parse_args()
+
+	settings = {"max_offset": args.max_offset, "altitudes": args.altitudes, "attitude_noise": args.attitude_noise,
+	            "dropout": args.dropout, "latency": args.latency, "timeout": args.timeout}
+	options = {"coarse": args.coarse} if args.coarse else {}
+	summary = campaign(args.runs, settings, args.jobs, args.seed, args.detector, options, args.background,
+	                   args.render_cache * 1024 * 1024)
+	with open(args.output, "w") as f:
+		json.dump(summary, f, indent=1, sort_keys=True)
+
+	print("%d runs in %.1f s, %d landed, landing error p50 %s m p95 %s m, time to land p50 %s s, frame compute p50 %s ms" % (
+		summary["runs"], summary["wall_s"], summary["landed"], summary["landing_error_m"].get("p50"),
+		summary["landing_error_m"].get("p95"), summary["time_to_land_s"].get("p50"), summary["frame_compute_ms"].get("p50")))
@@ -13,7 +13,9 @@ from pymavlink import mavutil
 #Common Library Imports
 from flight_assist import send_velocity
 from position_vector import PositionVector
+import camera_model
 import pid
+import search_image
 import sim
 
 #Python Imports
@@ -24,27 +26,41 @@ import argparse
 #Global Variables
 x_pid = pid.pid(0.1, 0.005, 0.1, 50)
 y_pid = pid.pid(0.1, 0.005, 0.1, 50)
-hfov = 60
-hres = 640
-vfov = 60
-vres = 480
+# detection centers are in pixels of search_image's reference frame, whatever the camera delivers
+hfov = camera_model.hfov
+hres = search_image.hres
+vfov = camera_model.vfov
+vres = search_image.vres
 x_pre = 0
 y_pre = 0
+max_dt = 1.0 #seconds, after a longer gap between commands the PID does not integrate
+verbose = True #print the offsets and commanded velocities every frame
+
+def reset():
+	'''
+	Clear the PID state left over from a previous landing.
+	'''
+	for controller in (x_pid, y_pid):
+		controller.reset_I()
+		controller.last_error = None
 
 def pixels_per_meter(fov, res, alt):
 	return ( ( alt * math.tan(math.radians(fov/2)) ) / (res/2) )
 
-def land(vehicle, target, attitude, location):
+def land(vehicle, target, attitude, location, dt=0.1):
+	'''
+	dt is the time in seconds since the previous call, the PIDs integrate over it.
+	'''
 	if(vehicle.location.global_relative_frame.alt <= 2.7):
 		vehicle.mode = VehicleMode('LAND')
 	if(target is not None):
-		move_to_target(vehicle,target,attitude,location)
+		move_to_target(vehicle,target,attitude,location,dt)
 	elif(vehicle.location.global_relative_frame.alt > 30):
 		vehicle.mode = VehicleMode('LAND')
 	else:
 		send_velocity(vehicle, 0, 0, -0.25, 1)
 		
-def move_to_target(vehicle,target,attitude,location):
+def move_to_target(vehicle,target,attitude,location,dt=0.1):
 	x,y = target
 
 	alt = vehicle.location.global_relative_frame.alt
@@ -54,13 +70,16 @@ def move_to_target(vehicle,target,attitude,location):
 	x *= px_meter_x
 	y *= px_meter_y
 
-	vx = x_pid.get_pid(x, 0.1)
-	vy = y_pid.get_pid(y, 0.1)
+	if dt > max_dt:
+		dt = 0.0
+	vx = x_pid.get_pid(x, dt)
+	vy = y_pid.get_pid(y, dt)
 	
-	print("x = " + str(x))
-	print("vx = " + str(vx))
-	print("y = " + str(y))
-	print("vy = " + str(vy))
+	if verbose:
+		print("x = " + str(x))
+		print("vx = " + str(vx))
+		print("y = " + str(y))
+		print("vy = " + str(vy))
 
 	if(math.sqrt(x**2 + y**2) > 2):
 		vz = 0
@@ -0,0 +1,129 @@
+'''
+
+	Synopsis: Long-lived pool of detector processes fed from a work queue.
+
+'''
+
+#Python Imports
+import multiprocessing
+import queue
+import time
+
+#Common Library Imports
+import detectors
+
+# the detector is built in the parent and inherited by the workers, which needs fork
+context = multiprocessing.get_context("fork")
+poll_interval = 0.1 #seconds between checks that the workers are still alive
+
+def detector_worker(task_queue, result_queue, ring, detector):
+	'''
+	Worker loop. The detector (e.g. the cascade) was loaded once by the
+	parent, every task only pays for the detection. Tasks carry either the
+	frame itself or a slot index into ring.
+	'''
+	detect = detector.detect
+	while True:
+		task = task_queue.get()
+		if task is None:
+			break
+		seq, frame, location, attitude, window = task
+		if isinstance(frame, int):
+			frame = ring.slot(frame)
+		start = time.monotonic()
+		detection = detect(frame, location, attitude, window)
+		result_queue.put((seq, detection, (start, time.monotonic())))
+
+class DetectorPool(object):
+
+	def __init__(self, workers=1, ring=None, detector="haar", options=None):
+		# built here so an unknown name or a missing cascade raises now, not in a worker
+		instance = detectors.create(detector, **(options or {}))
+		self.task_queue = context.Queue()
+		self.result_queue = context.Queue()
+		self.next_seq = 0
+		self.pending = 0
+		self.processes = []
+		for i in range(workers):
+			proc = context.Process(name="detector" + str(i), target=detector_worker,
+			                       args=(self.task_queue, self.result_queue, ring, instance))
+			proc.daemon = True
+			proc.start()
+			self.processes.append(proc)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def submit(self, frame, location, attitude, window=None):
+		'''
+		Queue a frame for detection and return its sequence number. window
+		restricts the search to (x, y, w, h) of the frame.
+		'''
+		seq = self.next_seq
+		self.next_seq += 1
+		self.pending += 1
+		self.task_queue.put((seq, frame, location, attitude, window))
+		return seq
+
+	def submit_slot(self, slot, location, attitude, window=None):
+		'''
+		Queue a frame already written to slot of the pool's FrameRing. The slot
+		must not be reused until its result has been received.
+		'''
+		return self.submit(int(slot), location, attitude, window)
+
+	def get(self, timeout=None):
+		'''
+		Return the next (seq, detection, (start, end)). detection is a
+		detectors.Detection; start and end are the worker's time.monotonic()
+		around the detection. Results may arrive out of order when more than
+		one worker is running. Raises queue.Empty when timeout expires and
+		RuntimeError when a worker has died, instead of waiting forever.
+		'''
+		deadline = None if timeout is None else time.monotonic() + timeout
+		while True:
+			wait = poll_interval
+			if deadline is not None:
+				wait = min(wait, max(0.0, deadline - time.monotonic()))
+			try:
+				seq, detection, timing = self.result_queue.get(timeout=wait)
+				break
+			except queue.Empty:
+				for proc in self.processes:
+					if not proc.is_alive():
+						raise RuntimeError("Detector worker %s exited with code %s" % (proc.name, proc.exitcode))
+				if deadline is not None and time.monotonic() >= deadline:
+					raise
+		self.pending -= 1
+		return seq, detection, timing
+
+	def wait(self, seq, timeout=None):
+		'''
+		Return (detection, (start, end)) for the frame submitted as seq, for
+		callers with one frame in flight. Results of other submissions still
+		queued, e.g. after a get() that timed out, are dropped so a stale
+		detection is never taken for this frame.
+		'''
+		while True:
+			result_seq, detection, timing = self.get(timeout)
+			if result_seq == seq:
+				return detection, timing
+
+	def close(self, timeout=1.0):
+		'''
+		Stop the workers once they have drained the queue. Workers that do not
+		exit within timeout are terminated.
+		'''
+		for proc in self.processes:
+			self.task_queue.put(None)
+		for proc in self.processes:
+			proc.join(timeout)
+			if proc.is_alive():
+				proc.terminate()
+		# frames no worker will read any more must not block interpreter exit
+		self.task_queue.cancel_join_thread()
+		self.processes = []
+		self.pending = 0
@@ -0,0 +1,141 @@
+'''
+
+	Synopsis: Detector interface and registry. Every backend returns a Detection, so
+	detectors can be chosen (and benchmarked) by name at runtime.
+
+'''
+
+#Python Imports
+import abc
+import os
+
+#Opencv Imports
+import cv2
+
+#Common Library Imports
+import search_image
+
+resources = os.path.dirname(os.path.realpath(__file__))+"/Resources"
+
+class Detection(object):
+	'''
+	Result of one detection pass. center is relative to the middle of the image
+	with y up, in pixels of a search_image.hres x vres frame whatever size was
+	searched (what control.land expects), boxes holds (x, y, w, h) rows, pose
+	is (rvec, tvec) in metres for the fiducial backends, confidence is a backend
+	specific score (0 when nothing was found) and ms the time the pass took.
+	'''
+	__slots__ = ("center", "boxes", "pose", "confidence", "ms")
+
+	def __init__(self, ms, center=None, boxes=None, pose=None, confidence=0.0):
+		self.ms = ms
+		self.center = center
+		self.boxes = boxes
+		self.pose = pose
+		self.confidence = confidence
+
+	@property
+	def found(self):
+		return self.center is not None
+
+	def __repr__(self):
+		return "Detection(center=%s, boxes=%d, confidence=%s, ms=%s)" % (
+			self.center, 0 if self.boxes is None else len(self.boxes), self.confidence, self.ms)
+
+registry = {}
+
+def register(name):
+	'''
+	Class decorator adding a Detector to the registry under name.
+	'''
+	def add(cls):
+		cls.name = name
+		registry[name] = cls
+		return cls
+	return add
+
+def available():
+	return sorted(registry)
+
+def create(name, **kwargs):
+	if name not in registry:
+		raise KeyError("Unknown detector %s, available: %s" % (name, ", ".join(available())))
+	return registry[name](**kwargs)
+
+class Detector(abc.ABC):
+	'''
+	Backends implement detect(img, location, attitude, window) -> Detection.
+	window optionally restricts the search to (x, y, w, h) of the frame.
+	'''
+	name = None
+
+	@abc.abstractmethod
+	def detect(self, img, location=None, attitude=None, window=None):
+		pass
+
+def track_flow(flow_tracker, img, trace=None):
+	'''
+	Detection for img from a search_image.FlowTracker, or None when the tracker
+	has no box or has lost it and the detector has to run.
+	'''
+	if flow_tracker.needs_detection():
+		return None
+	if trace is not None:
+		trace.mark("detect_start")
+	start = search_image.current_milli_time()
+	target = flow_tracker.track(img)
+	stop = search_image.current_milli_time()
+	if trace is not None:
+		trace.mark("detect_end")
+	if target is None:
+		return None
+	return Detection(stop-start, search_image.target_center(target[-1], img.shape), target, None, float(len(flow_tracker.points)))
+
+@register("haar")
+class CascadeDetector(Detector):
+	cascade_file = "target_cascade.xml"
+
+	def __init__(self, cascade_file=None, scale_factor=1.1, min_neighbors=5, coarse=None):
+		'''
+		coarse (2 or 4) enables the coarse-to-fine search: candidates are found
+		on a downscaled frame and confirmed at full resolution.
+		'''
+		if cascade_file is None:
+			cascade_file = resources + "/" + self.cascade_file
+		self.cascade = cv2.CascadeClassifier(cascade_file)
+		if self.cascade.empty():
+			raise IOError("Could not load cascade " + cascade_file)
+		self.scale_factor = scale_factor
+		self.min_neighbors = min_neighbors
+		self.coarse = coarse
+
+	def detect(self, img, location=None, attitude=None, window=None):
+		start = search_image.current_milli_time()
+		if self.coarse:
+			target, neighbours = search_image.coarse_to_fine_search(self.cascade, img, location, attitude, window,
+			                                                        self.scale_factor, self.min_neighbors, self.coarse)
+		else:
+			target, neighbours = search_image.cascade_search(self.cascade, img, location, attitude, window,
+			                                                 self.scale_factor, self.min_neighbors)
+		stop = search_image.current_milli_time()
+		if len(target) == 0:
+			return Detection(stop-start)
+		return Detection(stop-start, search_image.target_center(target[-1], img.shape), target, None, float(neighbours[-1]))
+
+@register("apriltag")
+class AprilTagDetector(Detector):
+
+	def detect(self, img, location=None, attitude=None, window=None):
+		ms, center, target, pose = search_image.detect_fiducial(img, location, attitude, window)
+		if center is None:
+			return Detection(ms)
+		return Detection(ms, center, target, pose, float(len(target)))
+
+@register("charuco_diamond")
+class DiamondDetector(Detector):
+
+	def detect(self, img, location=None, attitude=None, window=None):
+		ms, center, target, pose = search_image.detect_diamond(img, location, attitude, window)
+		if center is None:
+			return Detection(ms)
+		return Detection(ms, center, target, pose, float(len(target)))
@@ -13,6 +13,7 @@ from pymavlink import mavutil
 #Python Imports
 import time 
 import math
+import threading
 
 
 def epm_engage(vehicle):
@@ -346,6 +347,88 @@ def goto(vehicle, dNorth, dEast, gotoFunction=vehicle.simple_goto):
 
 
 """
+class SetpointStreamer(object):
+    """
+    Background thread that owns the resend cadence of velocity setpoints.
+
+    In GUIDED mode ArduCopter/PX4 drop a velocity setpoint when it is not
+    refreshed, so the current message is re-sent every `period` seconds until
+    its duration runs out. Callers only replace the setpoint and return at
+    once; a newer setpoint replaces the stale one on the next tick.
+
+    Durations are measured with `clock`, monotonic by default so a wall clock
+    step (NTP) cannot stretch or cut a setpoint short. Offline runs pass the
+    simulated vehicle's clock and call tick() themselves instead of start().
+    """
+
+    def __init__(self, vehicle, period=0.1, clock=time.monotonic):
+        self.vehicle = vehicle
+        self.period = period
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.msg = None
+        self.expires = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(name="setpoints", target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def set(self, msg, duration):
+        """
+        Stream msg for the next `duration` seconds, replacing the current setpoint.
+        """
+        with self.lock:
+            self.msg = msg
+            self.expires = self.clock() + duration
+        self.wakeup.set()
+
+    def tick(self):
+        with self.lock:
+            msg = self.msg
+            if msg is not None and self.clock() > self.expires:
+                msg = self.msg = None
+        if msg is not None:
+            self.vehicle.send_mavlink(msg)
+
+    def run(self):
+        while self.running:
+            self.tick()
+            self.wakeup.wait(self.period)
+            self.wakeup.clear()
+
+
+# streamers registered per vehicle, used by send_ned_velocity and send_velocity
+setpoint_streamers = {}
+
+def start_setpoint_streamer(vehicle, period=0.1, clock=time.monotonic, threaded=True):
+    """
+    Make send_ned_velocity and send_velocity non-blocking for this vehicle.
+    Without threaded the caller drives the streamer with tick().
+    """
+    streamer = SetpointStreamer(vehicle, period, clock)
+    if threaded:
+        streamer.start()
+    setpoint_streamers[vehicle] = streamer
+    return streamer
+
+def stop_setpoint_streamer(vehicle):
+    streamer = setpoint_streamers.pop(vehicle, None)
+    if streamer is not None:
+        streamer.stop()
+
+
 """
 Functions that move the vehicle by specifying the velocity components in each direction.
 The two functions use different MAVLink commands. The main difference is
@@ -383,6 +466,10 @@ def send_ned_velocity(vehicle, velocity_x, velocity_y, velocity_z, duration):
         velocity_x, velocity_y, velocity_z, # x, y, z velocity in m/s
         0, 0, 0, # x, y, z acceleration (not supported yet, ignored in GCS_Mavlink)
         0, 0)    # yaw, yaw_rate (not supported yet, ignored in GCS_Mavlink) 
+    if vehicle in setpoint_streamers:
+        setpoint_streamers[vehicle].set(msg, duration)
+        return
+
     if duration < 1:
 	    duration = int(duration*10)
 
@@ -405,6 +492,10 @@ def send_velocity(vehicle, velocity_y, velocity_x, velocity_z, duration):
         0, 0, 0, # x, y, z acceleration (not supported yet, ignored in GCS_Mavlink)
         0, 0)    # yaw, yaw_rate (not supported yet, ignored in GCS_Mavlink) 
 
+    if vehicle in setpoint_streamers:
+        setpoint_streamers[vehicle].set(msg, duration)
+        return
+
     if duration < 1:
         duration = int(duration*10)
 
@@ -0,0 +1,67 @@
+'''
+
+	Synopsis: Ring of preallocated frame slots in shared memory, so frames can be handed
+	to the detector processes by slot index instead of being pickled.
+
+'''
+
+#Python Imports
+from multiprocessing import shared_memory
+import threading
+
+#Opencv Imports
+import numpy as np
+
+class FrameRing(object):
+
+	def __init__(self, slots=4, shape=(480, 640, 3), dtype=np.uint8, name=None):
+		self.slots = slots
+		self.shape = tuple(shape)
+		self.dtype = np.dtype(dtype)
+		self.slot_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+		self.owner = name is None
+		if self.owner:
+			self.shm = shared_memory.SharedMemory(create=True, size=self.slot_bytes * slots)
+		else:
+			self.shm = shared_memory.SharedMemory(name=name)
+		self.frames = np.ndarray((slots,) + self.shape, dtype=self.dtype, buffer=self.shm.buf)
+		self.busy = set()
+		self.next_slot = 0
+		# the pipeline stages acquire and release from different threads
+		self.lock = threading.Lock()
+
+	# pickle as a reference to the shared block so the pixels never go through the pipe
+	def __getstate__(self):
+		return (self.shm.name, self.slots, self.shape, self.dtype.str)
+
+	def __setstate__(self, state):
+		name, slots, shape, dtype = state
+		self.__init__(slots, shape, dtype, name)
+
+	def slot(self, index):
+		return self.frames[index]
+
+	def acquire(self):
+		'''
+		Return (index, frame) for the next free slot. The producer fills frame in
+		place and passes index to the consumer. Only the creating process hands
+		out and releases slots, from any of its threads.
+		'''
+		with self.lock:
+			for i in range(self.slots):
+				index = (self.next_slot + i) % self.slots
+				if index not in self.busy:
+					self.busy.add(index)
+					self.next_slot = (index + 1) % self.slots
+					return index, self.frames[index]
+		raise RuntimeError("FrameRing: all %d slots in use, more frames in flight than slots" % self.slots)
+
+	def release(self, index):
+		with self.lock:
+			self.busy.discard(index)
+
+	def close(self):
+		self.frames = None
+		self.shm.close()
+		if self.owner:
+			self.shm.unlink()
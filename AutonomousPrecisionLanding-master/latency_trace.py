@@ -0,0 +1,79 @@
+'''
+
+	Synopsis: Per-frame latency tracing. Every frame carries monotonic timestamps for
+	each stage it goes through; at the end of a flight the per-stage latency
+	percentiles are written to a small JSON file.
+
+'''
+
+#Python Imports
+import json
+import time
+
+#Opencv Imports
+import numpy as np
+
+# (name, from, to) pairs of timestamps that make up a stage
+stages = (
+	("capture_to_enqueue", "capture", "enqueue"),
+	("queue_wait", "enqueue", "detect_start"),
+	("detection", "detect_start", "detect_end"),
+	("detection_to_control", "detect_end", "control"),
+	("detection_to_log", "detect_end", "log_write"),
+	("capture_to_control", "capture", "control"),
+)
+
+class FrameTrace(object):
+	__slots__ = ("seq", "capture", "enqueue", "detect_start", "detect_end", "control", "log_write")
+
+	def __init__(self, seq):
+		self.seq = seq
+		self.capture = time.monotonic()
+		self.enqueue = None
+		self.detect_start = None
+		self.detect_end = None
+		self.control = None
+		self.log_write = None
+
+	def mark(self, stage):
+		setattr(self, stage, time.monotonic())
+
+class TraceRecorder(object):
+
+	def __init__(self):
+		self.traces = []
+		self.next_seq = 0
+
+	def start(self):
+		'''
+		Create the trace for a frame about to be captured. sim.get_frame and
+		video.get_frame stamp capture again right before they render or grab,
+		so the render or grab time counts towards capture_to_enqueue.
+		'''
+		trace = FrameTrace(self.next_seq)
+		self.next_seq += 1
+		self.traces.append(trace)
+		return trace
+
+	def summary(self):
+		'''
+		Return {stage: {count, p50, p95, p99, max}} with latencies in ms. Frames
+		that never reached a stage (e.g. dropped by the video logger) are left
+		out of that stage only.
+		'''
+		result = {"frames": len(self.traces)}
+		for name, first, last in stages:
+			samples = [getattr(t, last) - getattr(t, first) for t in self.traces
+			           if getattr(t, first) is not None and getattr(t, last) is not None]
+			if not samples:
+				result[name] = {"count": 0}
+				continue
+			ms = np.array(samples) * 1000.0
+			p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+			result[name] = {"count": len(samples), "p50": round(p50, 2), "p95": round(p95, 2),
+			                "p99": round(p99, 2), "max": round(float(ms.max()), 2)}
+		return result
+
+	def write(self, path):
+		with open(path, "w") as f:
+			json.dump(self.summary(), f, separators=(",", ":"))
@@ -8,13 +8,20 @@
 
 # Dronekit imports
 from dronekit import connect, VehicleMode, LocationGlobalRelative, LocationGlobal, Command
-from dronekit_sitl import SITL
 from pymavlink import mavutil
 
 # Helper Libraries Imports
 import search_image
-import multiprocessing
-from flight_assist import arm_and_takeoff
+import detectors
+from detector_pool import DetectorPool
+from frame_ring import FrameRing
+from pipeline import Pipeline
+from video_logger import VideoLogger
+from latency_trace import TraceRecorder
+from target_tracker import KalmanTracker
+import camera_model
+from flight_assist import arm_and_takeoff, start_setpoint_streamer, stop_setpoint_streamer
+from sim_vehicle import SimVehicle
 import control
 import sim
 import video
@@ -33,7 +40,6 @@ import re
 if __name__ == '__main__':
 	simulation = False
 	sitl = None
-	parent_conn_im, child_conn_im = multiprocessing.Pipe()
 	imagequeue = queue.Queue()
 	vehiclequeue = queue.Queue()
 	frame_count = 0
@@ -42,13 +48,49 @@ if __name__ == '__main__':
 		description='Commands vehicle using vehicle.simple_goto.')
 	parser.add_argument(
 		'--connect', help="Vehicle connection target string. If not specified, SITL automatically started and used.")
+	parser.add_argument(
+		'--offline', action='store_true', help="Land the in-process simulated vehicle instead of SITL, as fast as frames can be rendered and processed.")
+	parser.add_argument(
+		'--pipeline', action='store_true', help="Run capture, detection, control and logging as independent stages. Without it the synchronous loop is used.")
+	parser.add_argument(
+		'--detector', choices=detectors.available(), default='haar', help="Target detection backend.")
+	parser.add_argument(
+		'--coarse', type=int, choices=[2, 4], help="Cascade detectors: search a downscaled frame first, then refine at full resolution.")
+	parser.add_argument(
+		'--track-roi', action='store_true', help="Search only around the last detection until it is lost.")
+	parser.add_argument(
+		'--flow', action='store_true', help="Follow the target with optical flow between detections, the detector only runs when the flow track is lost or needs a refresh.")
+	parser.add_argument(
+		'--kalman', action='store_true', help="Filter detections with a Kalman tracker and fly on its estimate.")
+	parser.add_argument(
+		'--detect-every', type=int, default=1, help="Run the detector on every Nth frame only, the Kalman tracker predicts the others. Implies --kalman when N > 1.")
+	parser.add_argument(
+		'--undistort', choices=camera_model.modes, default='none', help="Lens distortion handling: points undistorts only the target center, rectify remaps every frame before detection. The simulator renders without distortion.")
+	parser.add_argument(
+		'--log-raw', action='store_true', help="Also record the frames without the highlights to Logs/Vids/Raw, the input replay.py expects.")
+	parser.add_argument(
+		'--log-queue', type=int, default=8, help="Frames the video logger may queue before it starts dropping.")
+	parser.add_argument(
+		'--log-policy', choices=['drop_oldest', 'decimate'], default='drop_oldest', help="What the video logger does when it falls behind.")
+	parser.add_argument(
+		'--log-decimate', type=int, default=2, help="With --log-policy decimate, log only every Nth frame while the logger is behind.")
 	args = parser.parse_args()
 	connection_string = args.connect
+	if args.offline and args.pipeline:
+		parser.error("--offline runs the synchronous loop only")
+	# before anything is started, a calibration that does not fit fails here
+	camera = camera_model.default_model() if args.undistort != 'none' else None
 
-	if not args.connect:
+	if args.offline:
+		simulation = True
+		# frames are rendered for simulated time, not held to the camera rate
+		sim.set_realtime(False)
+	elif not args.connect:
 
 			simulation = True
 			print("Starting copter simulator (SITL)")
+			# --offline and --connect runs do not need dronekit_sitl installed
+			from dronekit_sitl import SITL
 			sitl = SITL()
 			sitl.download('copter', '3.3', verbose=True)
 			sitl_args = ['-I0', '--model', 'quad',
@@ -56,8 +98,28 @@ if __name__ == '__main__':
 			sitl.launch(sitl_args, await_ready=True, restart=True)
 			connection_string = 'tcp:127.0.0.1:5760'
 
-	print("Connecting to vehicle on: %s" % connection_string)
-	vehicle = connect(connection_string, wait_ready=True, baud=57600)
+	# Frames live in shared memory, only slot indices travel to the detectors
+	if simulation:
+		frame_shape = (sim.camera_height, sim.camera_width, 3)
+	else:
+		frame_shape = (video.frame_height, video.frame_width, 3)
+	frame_ring = FrameRing(slots=6 if args.pipeline else 3, shape=frame_shape)
+
+	# Start the detectors before connecting so they fork without dronekit's threads
+	detector_options = {"coarse": args.coarse} if args.coarse else {}
+	detector_pool = DetectorPool(workers=1, ring=frame_ring, detector=args.detector, options=detector_options)
+
+	clock = None
+	if args.offline:
+		vehicle = SimVehicle()
+		clock = vehicle.clock
+		# ticked from the landing loop on simulated time
+		streamer = start_setpoint_streamer(vehicle, clock=clock, threaded=False)
+	else:
+		print("Connecting to vehicle on: %s" % connection_string)
+		vehicle = connect(connection_string, wait_ready=True, baud=57600)
+		# velocity commands from control.land return at once, the streamer keeps resending them
+		start_setpoint_streamer(vehicle)
 
 	if simulation:
 		vehicle.mode = VehicleMode("GUIDED")
@@ -75,7 +137,12 @@ if __name__ == '__main__':
 		                                vehicle.location.global_relative_frame.lon - 0.00002, vehicle.location.global_relative_frame.alt)
 		sim.set_target_location(target)
 		print("Target set.")
-		arm_and_takeoff(vehicle, 10)
+		if args.offline:
+			vehicle.armed = True
+			vehicle.simple_takeoff(10)
+			vehicle.run_until(lambda: vehicle.location.global_relative_frame.alt >= 10*0.95)
+		else:
+			arm_and_takeoff(vehicle, 10)
 	else:
 		video.startCamera()
 
@@ -88,53 +155,125 @@ if __name__ == '__main__':
 		(os.path.dirname(os.path.realpath(__file__)))+'/Logs/Vids')])
 	vid = cv2.VideoWriter((os.path.dirname(os.path.realpath(
 		__file__)))+'/Logs/Vids/log'+str(i)+'.avi', fourcc, 10.0, (640, 480))
+	raw_vid = None
+	if args.log_raw:
+		raw_dir = (os.path.dirname(os.path.realpath(__file__)))+'/Logs/Vids/Raw'
+		if not os.path.isdir(raw_dir):
+			os.makedirs(raw_dir)
+		raw_vid = cv2.VideoWriter(raw_dir+'/log'+str(i)+'.avi', fourcc, 10.0, (frame_shape[1], frame_shape[0]))
+	video_logger = VideoLogger(vid, args.log_queue, args.log_policy, args.log_decimate, raw_vid=raw_vid)
+	recorder = TraceRecorder()
+	roi_tracker = search_image.RoiTracker() if args.track_roi else None
+	detect_every = max(1, args.detect_every)
+	kalman = KalmanTracker() if args.kalman or detect_every > 1 else None
+	flow_tracker = search_image.FlowTracker() if args.flow else None
+	# rectify captures into a scratch frame and remaps it into the ring slot
+	raw = np.empty(frame_shape, dtype=np.uint8) if args.undistort == 'rectify' else None
 
-	while True:
-		if not (vehicle.mode == "GUIDED"):
-			if simulation:
+	if args.pipeline:
+		Pipeline(vehicle, simulation, detector_pool, frame_ring, video_logger, recorder, roi_tracker,
+		         kalman, detect_every, flow_tracker, camera, args.undistort).run()
+	else:
+		# one frame per frame_period, the sleep only fills what the frame did not use
+		frame_period = 0.1
+		next_frame = time.monotonic()
+		last_stamp = None
+		while True:
+			if not (vehicle.armed):
 				break
+			if not (vehicle.mode == "GUIDED"):
+				if simulation:
+					break
+				else:
+					continue
+			location = vehicle.location.global_relative_frame
+			attitude = vehicle.attitude
+			print("Altitude =" + str(vehicle.location.global_relative_frame.alt))
+
+			slot, frame = frame_ring.acquire()
+			capture = raw if raw is not None else frame
+			trace = recorder.start()
+			if simulation:
+				sim.refresh_simulator(location, attitude)
+				sim.get_frame(attitude, out=capture, trace=trace)
+				if not args.offline:
+					cv2.waitKey(1)
 			else:
-				continue
-		if not (vehicle.armed):
-			break
-		location = vehicle.location.global_relative_frame
-		attitude = vehicle.attitude
-		print("Altitude =" + str(vehicle.location.global_relative_frame.alt))
-
-		if simulation:
-			sim.refresh_simulator(location, attitude)
-			frame = sim.get_frame(attitude)
-			cv2.waitKey(1)
-		else:
-			frame = video.get_frame()
+				video.get_frame(out=capture, trace=trace)
+			if raw is not None:
+				camera.remap(raw, out=frame)
 
-		imagequeue.put(frame)
-		vehiclequeue.put((location, attitude))
+			imagequeue.put(slot)
+			vehiclequeue.put((location, attitude))
 
-		img = multiprocessing.Process(name="img", target=search_image.analyze_frame, args=(
-			child_conn_im, frame, location, attitude))
-		img.daemon = True
-		img.start()
+			trace.mark("enqueue")
+			detection = None
+			if flow_tracker is not None:
+				detection = detectors.track_flow(flow_tracker, frame, trace)
+				if detection is not None and roi_tracker is not None:
+					# keep the search window on the target while flow follows it
+					roi_tracker.update(detection.boxes)
+			if detection is None and (flow_tracker is not None or frame_count % detect_every == 0):
+				window = roi_tracker.window(frame.shape) if roi_tracker is not None else None
+				seq = detector_pool.submit_slot(slot, location, attitude, window)
+				detection, (trace.detect_start, trace.detect_end) = detector_pool.wait(seq)
+				if roi_tracker is not None:
+					roi_tracker.update(detection.boxes)
+				if flow_tracker is not None:
+					flow_tracker.start(frame, detection.boxes)
+			elif detection is None:
+				detection = detectors.Detection(0)
 
-		results = parent_conn_im.recv()
+			frame_count += 1
 
-		frame_count += 1
+			slot = imagequeue.get()
+			img = frame_ring.slot(slot)
+			location, attitude = vehiclequeue.get()
 
-		img = imagequeue.get()
-		location, attitude = vehiclequeue.get()
-		rend_Image = search_image.add_target_highlights(img, results[2])
+			if simulation and not args.offline:
+				cv2.imshow("RAW", img)
+				if video_logger.latest is not None:
+					cv2.imshow("GUI", video_logger.latest)
 
-		if simulation:
-			cv2.imshow("RAW", img)
-			cv2.imshow("GUI", rend_Image)
+			video_logger.write(img.copy(), detection.boxes, trace)
+			frame_ring.release(slot)
 
-		vid.write(rend_Image)
+			center = detection.center
+			if args.undistort == 'points' and center is not None:
+				# centers are in pixels of the reference frame, not of img
+				center = camera.undistort_center(center, (search_image.vres, search_image.hres))
+			now = clock() if clock is not None else trace.capture
+			dt = 0.1 if last_stamp is None else now - last_stamp
+			last_stamp = now
+			if kalman is not None:
+				kalman.predict(now, attitude)
+				if center is not None:
+					kalman.update(center, now)
+				center = kalman.estimate(now)
+			control.land(vehicle, center, attitude, location, dt)
+			trace.mark("control")
+			if args.offline:
+				streamer.tick()
+				vehicle.step(frame_period)
+			else:
+				next_frame = max(next_frame + frame_period, time.monotonic())
+				time.sleep(max(0.0, next_frame - time.monotonic()))
 
-		control.land(vehicle, results[1], attitude, location)
-		time.sleep(0.1)
+	video_logger.close()
+	print(video_logger.stats())
+	if kalman is not None:
+		print(kalman.stats())
+	if flow_tracker is not None:
+		print(flow_tracker.stats())
 
-	vid.release()
+	trace_dir = (os.path.dirname(os.path.realpath(__file__)))+'/Logs/Traces'
+	if not os.path.isdir(trace_dir):
+		os.makedirs(trace_dir)
+	recorder.write(trace_dir+'/trace'+str(i)+'.json')
+	detector_pool.close()
+	frame_ring.close()
 
+	stop_setpoint_streamer(vehicle)
 	print("Closing vehicle")
 	vehicle.close()
 	if sitl is not None:
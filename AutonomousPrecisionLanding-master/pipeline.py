@@ -0,0 +1,247 @@
+'''
+
+	Synopsis: Pipelined landing loop. Capture, detection, control and logging run as
+	independent stages connected by single-slot "latest value" mailboxes, so the
+	control stage always acts on the freshest detection. Control runs at its own
+	rate, with a Kalman tracker it steers on the prediction between detections.
+
+'''
+
+#Python Imports
+import threading
+import time
+
+#Opencv Imports
+import cv2
+import numpy as np
+
+#Common Library Imports
+import control
+import detectors
+import search_image
+import sim
+import video
+
+class Mailbox(object):
+	'''
+	Single-slot mailbox. put() overwrites whatever is in the slot and returns the
+	value it displaced (or None if that value was already taken), get() returns
+	the newest value.
+	'''
+
+	def __init__(self):
+		self.cond = threading.Condition()
+		self.value = None
+		self.version = 0
+		self.taken = True
+		self.closed = False
+
+	def put(self, value):
+		with self.cond:
+			displaced = None if self.taken else self.value
+			self.value = value
+			self.version += 1
+			self.taken = False
+			self.cond.notify_all()
+			return displaced
+
+	def get(self, timeout=None):
+		'''
+		Wait until a value that has not been taken yet is available and take it.
+		Returns None on timeout or once the mailbox is closed.
+		'''
+		with self.cond:
+			if self.taken and not self.closed:
+				self.cond.wait(timeout)
+			if self.taken:
+				return None
+			self.taken = True
+			return self.value
+
+	def close(self):
+		'''
+		Wake up every waiting stage. Returns the value still in the slot if it
+		was never taken.
+		'''
+		with self.cond:
+			self.closed = True
+			self.cond.notify_all()
+			if self.taken:
+				return None
+			self.taken = True
+			return self.value
+
+class Pipeline(object):
+
+	def __init__(self, vehicle, simulation, detector_pool, frame_ring, video_logger, recorder, roi_tracker=None,
+	             kalman=None, detect_every=1, flow_tracker=None, camera=None, undistort="none", control_period=0.1):
+		self.vehicle = vehicle
+		self.simulation = simulation
+		self.detector_pool = detector_pool
+		self.frame_ring = frame_ring
+		self.video_logger = video_logger
+		self.recorder = recorder
+		self.roi_tracker = roi_tracker
+		self.kalman = kalman
+		self.detect_every = max(1, detect_every)
+		self.flow_tracker = flow_tracker
+		self.camera = camera
+		self.undistort = undistort
+		self.control_period = control_period
+		self.frames = Mailbox()
+		self.detections = Mailbox()
+		self.logs = Mailbox()
+		self.running = threading.Event()
+		self.frame_count = 0
+
+	def release(self, packet):
+		if packet is not None:
+			self.frame_ring.release(packet["slot"])
+
+	def capture_stage(self):
+		raw = None
+		if self.undistort == "rectify":
+			raw = np.empty(self.frame_ring.shape, dtype=self.frame_ring.dtype)
+		while self.running.is_set():
+			if not (self.vehicle.armed):
+				break
+			if not (self.vehicle.mode == "GUIDED"):
+				if self.simulation:
+					break
+				else:
+					time.sleep(0.1)
+					continue
+			location = self.vehicle.location.global_relative_frame
+			attitude = self.vehicle.attitude
+			try:
+				slot, frame = self.frame_ring.acquire()
+			except RuntimeError:
+				# every slot is still held by a downstream stage
+				time.sleep(0.005)
+				continue
+			capture = raw if raw is not None else frame
+			trace = self.recorder.start()
+			if self.simulation:
+				sim.refresh_simulator(location, attitude)
+				sim.get_frame(attitude, out=capture, trace=trace)
+			else:
+				video.get_frame(out=capture, trace=trace)
+			if raw is not None:
+				self.camera.remap(raw, out=frame)
+			self.release(self.frames.put({"slot": slot, "location": location, "attitude": attitude,
+			                              "trace": trace}))
+		self.running.clear()
+
+	def detection_stage(self):
+		while self.running.is_set():
+			packet = self.frames.get(timeout=0.1)
+			if packet is None:
+				continue
+			trace = packet["trace"]
+			trace.mark("enqueue")
+			detection = None
+			skipped = False
+			if self.flow_tracker is not None:
+				detection = detectors.track_flow(self.flow_tracker, self.frame_ring.slot(packet["slot"]), trace)
+			if detection is not None:
+				packet["detection"] = detection
+				if self.roi_tracker is not None:
+					# keep the search window on the target while flow follows it
+					self.roi_tracker.update(detection.boxes)
+			elif self.flow_tracker is not None or self.frame_count % self.detect_every == 0:
+				window = None
+				if self.roi_tracker is not None:
+					window = self.roi_tracker.window(self.frame_ring.shape)
+				seq = self.detector_pool.submit_slot(packet["slot"], packet["location"], packet["attitude"], window)
+				packet["detection"], (trace.detect_start, trace.detect_end) = self.detector_pool.wait(seq)
+				if self.roi_tracker is not None:
+					self.roi_tracker.update(packet["detection"].boxes)
+				if self.flow_tracker is not None:
+					self.flow_tracker.start(self.frame_ring.slot(packet["slot"]), packet["detection"].boxes)
+			else:
+				skipped = True
+				packet["detection"] = detectors.Detection(0)
+			self.frame_count += 1
+			if not skipped:
+				# skipped frames are only logged, control keeps flying on the Kalman prediction
+				self.detections.put(packet)
+			self.release(self.logs.put(packet))
+
+	def control_stage(self):
+		'''
+		Steer on every new detection, and at least every control_period. When
+		no detection arrives in time the Kalman tracker is propagated to now
+		and flown on; without one the last velocity command stays in force
+		until the next detection. The PIDs integrate over the real time
+		between commands.
+		'''
+		last_command = None
+		deadline = time.monotonic() + self.control_period
+		while self.running.is_set():
+			packet = self.detections.get(timeout=max(0.0, deadline - time.monotonic()))
+			now = time.monotonic()
+			if packet is not None:
+				location, attitude = packet["location"], packet["attitude"]
+				center = packet["detection"].center
+				if self.undistort == "points" and center is not None:
+					# centers are in pixels of the reference frame, not of the ring's frames
+					center = self.camera.undistort_center(center, (search_image.vres, search_image.hres))
+				if self.kalman is not None:
+					# filter at capture time, the frame may have waited behind the detector,
+					# unless the track was already predicted past it
+					capture = max(packet["trace"].capture, self.kalman.last_time or 0.0)
+					self.kalman.predict(capture, attitude)
+					if center is not None:
+						self.kalman.update(center, capture)
+					center = self.kalman.estimate(capture)
+			elif self.kalman is not None and self.kalman.active and now >= deadline:
+				location = self.vehicle.location.global_relative_frame
+				attitude = self.vehicle.attitude
+				self.kalman.predict(now, attitude)
+				center = self.kalman.estimate(now)
+			else:
+				if now >= deadline:
+					deadline = now + self.control_period
+				continue
+			dt = self.control_period if last_command is None else now - last_command
+			last_command = now
+			deadline = now + self.control_period
+			control.land(self.vehicle, center, attitude, location, dt)
+			if packet is not None:
+				packet["trace"].mark("control")
+
+	def logging_stage(self):
+		# runs on the calling thread because the highgui windows must stay there
+		while self.running.is_set():
+			packet = self.logs.get(timeout=0.1)
+			if packet is None:
+				continue
+			img = self.frame_ring.slot(packet["slot"])
+			if self.simulation:
+				cv2.imshow("RAW", img)
+				if self.video_logger.latest is not None:
+					cv2.imshow("GUI", self.video_logger.latest)
+				cv2.waitKey(1)
+			self.video_logger.write(img.copy(), packet["detection"].boxes, packet["trace"])
+			self.release(packet)
+
+	def run(self):
+		'''
+		Run until the vehicle disarms (or leaves GUIDED in simulation).
+		'''
+		self.running.set()
+		stages = [threading.Thread(name=name, target=stage) for name, stage in
+		          (("capture", self.capture_stage), ("detection", self.detection_stage),
+		           ("control", self.control_stage))]
+		for stage in stages:
+			stage.daemon = True
+			stage.start()
+		try:
+			self.logging_stage()
+		finally:
+			self.running.clear()
+			for stage in stages:
+				stage.join()
+			self.release(self.frames.close())
+			self.detections.close()
+			self.release(self.logs.close())
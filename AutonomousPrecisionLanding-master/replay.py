@@ -0,0 +1,144 @@
+'''
+
+	Synopsis: Headless replay of recorded landing videos through the detectors. Frames
+	are sharded across all cores as fast as they can be decoded and the per-frame
+	detections are written to a columnar .npz file. Replay the raw recordings
+	(main.py --log-raw, Logs/Vids/Raw); the Logs/Vids logs have the detection boxes
+	drawn in, which would bias the detectors being evaluated.
+
+'''
+
+#Python Imports
+import argparse
+import glob
+import multiprocessing
+import os
+import time
+
+#Opencv Imports
+import cv2
+import numpy as np
+
+#Common Library Imports
+import detectors
+
+columns = ("video", "frame", "x", "y", "w", "h", "center_x", "center_y", "boxes", "confidence", "ms")
+detector = None
+
+def init_worker(name):
+	global detector
+	# one frame per core already, keep OpenCV from spawning its own threads on top
+	cv2.setNumThreads(1)
+	detector = detectors.create(name)
+
+def replay_chunk(task):
+	'''
+	Decode frames [start, start+count) of one video and run the detector on
+	each. Returns a dict of column lists. count < 0 reads to the end.
+	'''
+	video_index, path, start, count = task
+	result = dict((name, []) for name in columns)
+	cap = cv2.VideoCapture(path)
+	if start > 0:
+		cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+	frame_index = start
+	while count < 0 or frame_index < start + count:
+		success_flag, frame = cap.read()
+		if not success_flag:
+			break
+		begin = time.perf_counter()
+		detection = detector.detect(frame)
+		elapsed = (time.perf_counter() - begin) * 1000.0
+		result["video"].append(video_index)
+		result["frame"].append(frame_index)
+		if detection.center is None:
+			x, y, w, h = -1, -1, -1, -1
+			center = (np.nan, np.nan)
+			boxes = 0
+		else:
+			# the detectors report the center of the last box, keep that box
+			x, y, w, h = detection.boxes[-1]
+			center = detection.center
+			boxes = len(detection.boxes)
+		for name, value in zip(("x", "y", "w", "h"), (x, y, w, h)):
+			result[name].append(value)
+		result["center_x"].append(center[0])
+		result["center_y"].append(center[1])
+		result["boxes"].append(boxes)
+		result["confidence"].append(detection.confidence)
+		result["ms"].append(elapsed)
+		frame_index += 1
+	cap.release()
+	return result
+
+def make_tasks(paths, chunk):
+	tasks = []
+	for video_index, path in enumerate(paths):
+		cap = cv2.VideoCapture(path)
+		frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+		cap.release()
+		if frames <= 0:
+			# container does not report a length, decode it in one piece
+			tasks.append((video_index, path, 0, -1))
+			continue
+		for start in range(0, frames, chunk):
+			tasks.append((video_index, path, start, min(chunk, frames - start)))
+	return tasks
+
+def replay(paths, output, jobs=None, chunk=250, detector_name="haar"):
+	tasks = make_tasks(paths, chunk)
+	merged = dict((name, []) for name in columns)
+	start = time.time()
+	pool = multiprocessing.Pool(jobs, initializer=init_worker, initargs=(detector_name,))
+	try:
+		for result in pool.imap_unordered(replay_chunk, tasks):
+			for name in columns:
+				merged[name].extend(result[name])
+	finally:
+		pool.close()
+		pool.join()
+	elapsed = time.time() - start
+
+	data = {
+		"video": np.array(merged["video"], dtype=np.int32),
+		"frame": np.array(merged["frame"], dtype=np.int32),
+		"x": np.array(merged["x"], dtype=np.int32),
+		"y": np.array(merged["y"], dtype=np.int32),
+		"w": np.array(merged["w"], dtype=np.int32),
+		"h": np.array(merged["h"], dtype=np.int32),
+		"center_x": np.array(merged["center_x"], dtype=np.float32),
+		"center_y": np.array(merged["center_y"], dtype=np.float32),
+		"boxes": np.array(merged["boxes"], dtype=np.int16),
+		"confidence": np.array(merged["confidence"], dtype=np.float32),
+		"ms": np.array(merged["ms"], dtype=np.float32),
+	}
+	order = np.lexsort((data["frame"], data["video"]))
+	for name in columns:
+		data[name] = data[name][order]
+	np.savez_compressed(output, paths=np.array(paths), **data)
+
+	frames = len(order)
+	print("Replayed %d frames from %d videos in %.1f s (%.1f frames/s), %d with a target" % (
+		frames, len(paths), elapsed, frames / max(elapsed, 1e-6), int((data["boxes"] > 0).sum())))
+
+if __name__ == "__main__":
+	log_dir = (os.path.dirname(os.path.realpath(__file__)))+'/Logs'
+	parser = argparse.ArgumentParser(
+		description='Rerun target detection over recorded landing videos.')
+	parser.add_argument(
+		'videos', nargs='*', help="Videos to replay. Defaults to every Logs/Vids/Raw/*.avi, recordings without the highlights.")
+	parser.add_argument(
+		'--output', default=log_dir+'/replay.npz', help="Columnar output file (numpy .npz).")
+	parser.add_argument(
+		'--jobs', type=int, default=None, help="Worker processes, defaults to one per core.")
+	parser.add_argument(
+		'--chunk', type=int, default=250, help="Frames per work item.")
+	parser.add_argument(
+		'--detector', choices=detectors.available(), default='haar', help="Detection backend to replay with.")
+	args = parser.parse_args()
+
+	videos = args.videos or sorted(glob.glob(log_dir+'/Vids/Raw/*.avi'))
+	if not videos:
+		print("No videos to replay, record raw ones with main.py --log-raw")
+	else:
+		replay(videos, args.output, args.jobs, args.chunk, args.detector)
@@ -8,7 +8,6 @@
 
 #Python Imports
 import urllib
-import os
 import math
 import time
 from copy import copy
@@ -17,36 +16,433 @@ from copy import copy
 import cv2
 import numpy as np
 
+#Common Library Imports
+import calibration_store
+import camera_model
+
 #Global Variables
 hres = 640
 vres = 480
-vfov = 48.7
-hfov = 49.7
-target_cascade = cv2.CascadeClassifier(os.path.dirname(os.path.realpath(__file__))+"/Resources/target_cascade.xml")
-if target_cascade.empty():
-	exit()
+target_size = 1.5 #metres, the landing pad simulated by sim.target_size
+scale_tolerance = 2.0 #boxes from 1/tolerance to tolerance times the expected size are searched
+min_scale_alt = 1.0 #below this the expected size is meaningless, search every scale
+marker_size = 0.136 #metres, side of the AprilTag used by the OpencvScripts
+diamond_square_size = 2 * marker_size #metres, ChArUco diamond square (square/marker rate 2 as in detectCharuco.py)
+marker_detector = None
+diamond_detector = None
 
 current_milli_time = lambda: int(round(time.time() * 1000))
 
-def analyze_frame(child_conn, img, location, attitude):
-	start = current_milli_time()
+def expected_target_size(alt, attitude=None, frame_size=(hres, vres)):
+	'''
+	Return the expected side of the target in pixels seen from alt metres in a
+	frame of frame_size (width, height), the whole camera image scaled to it.
+	Tilting the camera lengthens the line of sight and shrinks the target.
+	'''
+	distance = alt
+	if attitude is not None:
+		distance = alt / max(0.1, math.cos(attitude.pitch) * math.cos(attitude.roll))
+	focal_x = (frame_size[0]/2.0) / math.tan(math.radians(camera_model.hfov/2.0))
+	focal_y = (frame_size[1]/2.0) / math.tan(math.radians(camera_model.vfov/2.0))
+	return (focal_x + focal_y) / 2.0 * target_size / distance
+
+def scale_bounds(location, attitude=None, tolerance=None, frame_size=(hres, vres), window=None):
+	'''
+	Return (minSize, maxSize) for detectMultiScale at the current altitude, or
+	None when the altitude is unknown or too low to be useful. frame_size is
+	the (width, height) of the full frame; when only window (x, y, w, h) of it
+	is searched maxSize is capped to the window.
+	'''
+	if tolerance is None:
+		tolerance = scale_tolerance
+	if location is None or location.alt is None or location.alt < min_scale_alt:
+		return None
+	size = expected_target_size(location.alt, attitude, frame_size)
+	smallest = int(size / tolerance)
+	largest = int(math.ceil(size * tolerance))
+	if window is not None:
+		largest = min(largest, window[2], window[3])
+		smallest = min(smallest, largest)
+	return ((smallest, smallest), (largest, largest))
+
+def image_center(x, y, shape):
+	'''
+	Position of pixel (x, y) of a frame of the given shape relative to the
+	image middle, y up, in pixels of an hres x vres frame. Centers are
+	reported this way whatever size the frame was searched at, so control and
+	the Kalman tracker do not depend on the capture resolution.
+	'''
+	height, width = shape[:2]
+	return ((x - width/2.0) * hres / float(width), (height/2.0 - y) * vres / float(height))
+
+def target_center(box, shape):
+	'''
+	Return the center of an (x, y, w, h) box found in a frame of the given
+	shape, see image_center.
+	'''
+	x, y, w, h = box
+	return image_center(x + w/2.0, y + h/2.0, shape)
+
+def cascade_search(cascade, img, location=None, attitude=None, window=None, scale_factor=1.1, min_neighbors=5):
+	'''
+	Run cascade over img, or only over window (x, y, w, h) when one is given.
+	Returns (boxes, neighbours); boxes are always in full frame coordinates.
+	'''
 	gray = img
 	if(len(gray.shape) < 3):
 		gray = cv2.cvtColor(img,cv2.COLOR_GRAY2BGR)
+	if window is not None:
+		wx, wy, ww, wh = window
+		gray = gray[wy:wy+wh, wx:wx+ww]
 	
-	target = target_cascade.detectMultiScale(gray,1.1,5)
-	if len(target)>0:
-		center = (-1,-1)
-		distance = -1
-		for (x,y,w,h) in target:
-			x_true = x + w/2.0 - hres/2.0
-			y_true = -(y + h/2.0) + vres/2.0
-			center = (x_true, y_true)
-		stop = current_milli_time()
-		child_conn.send((stop-start, center, target))
+	bounds = scale_bounds(location, attitude, frame_size=(img.shape[1], img.shape[0]), window=window)
+	if bounds is None:
+		target, neighbours = cascade.detectMultiScale2(gray,scale_factor,min_neighbors)
+	else:
+		target, neighbours = cascade.detectMultiScale2(gray,scale_factor,min_neighbors,minSize=bounds[0],maxSize=bounds[1])
+	if len(target)>0 and window is not None:
+		target = target + (wx, wy, 0, 0)
+	return target, neighbours
+
+def coarse_to_fine_search(cascade, img, location=None, attitude=None, window=None, scale_factor=1.1,
+                          min_neighbors=5, coarse=2, refine_margin=0.5):
+	'''
+	Same contract as cascade_search. The cascade first runs on the frame shrunk
+	by coarse, then each candidate is confirmed and refined on a small full
+	resolution crop around it, so most pixels are only scanned at low
+	resolution. Refined boxes of the same target are merged by group_boxes. The coarse pass accepts weaker candidates (half of
+	min_neighbors) since every candidate is confirmed afterwards. When the
+	expected target would come out smaller than 1.5 cascade windows at that
+	factor the coarse factor is reduced (down to a plain search).
+	'''
+	gray = img
+	if(len(gray.shape) < 3):
+		gray = cv2.cvtColor(img,cv2.COLOR_GRAY2BGR)
+	wx, wy = 0, 0
+	if window is not None:
+		wx, wy, ww, wh = window
+		gray = gray[wy:wy+wh, wx:wx+ww]
+
+	bounds = scale_bounds(location, attitude, frame_size=(img.shape[1], img.shape[0]), window=window)
+	cascade_size = max(cascade.getOriginalWindowSize())
+	if bounds is not None:
+		expected = math.sqrt(bounds[0][0] * bounds[1][0])
+		while coarse > 1 and expected / float(coarse) < 1.5 * cascade_size:
+			coarse //= 2
+	if coarse <= 1:
+		return cascade_search(cascade, img, location, attitude, window, scale_factor, min_neighbors)
+
+	small = cv2.resize(gray, (gray.shape[1] // coarse, gray.shape[0] // coarse), interpolation=cv2.INTER_AREA)
+	coarse_neighbors = max(1, min_neighbors // 2)
+	if bounds is None:
+		candidates = cascade.detectMultiScale(small,scale_factor,coarse_neighbors)
 	else:
+		smallest = max(cascade_size, bounds[0][0] // coarse)
+		largest = max(smallest, bounds[1][0] // coarse)
+		candidates = cascade.detectMultiScale(small,scale_factor,coarse_neighbors,
+		                                      minSize=(smallest, smallest),maxSize=(largest, largest))
+
+	boxes = []
+	neighbours = []
+	for (x, y, w, h) in candidates:
+		x, y, w, h = x * coarse, y * coarse, w * coarse, h * coarse
+		grow = int(refine_margin * max(w, h)) + coarse
+		x0, y0 = max(0, x - grow), max(0, y - grow)
+		x1, y1 = min(gray.shape[1], x + w + grow), min(gray.shape[0], y + h + grow)
+		# same scale range as a plain search so the refined box lands on the same pyramid levels
+		if bounds is None:
+			found, counts = cascade.detectMultiScale2(gray[y0:y1, x0:x1],scale_factor,min_neighbors,
+			                                          maxSize=(2 * w, 2 * h))
+		else:
+			found, counts = cascade.detectMultiScale2(gray[y0:y1, x0:x1],scale_factor,min_neighbors,
+			                                          minSize=bounds[0],maxSize=bounds[1])
+		for box, count in zip(found, counts):
+			boxes.append(box + (x0 + wx, y0 + wy, 0, 0))
+			neighbours.append(count)
+	return group_boxes(np.array(boxes, dtype=np.int32).reshape(-1, 4), np.array(neighbours, dtype=np.int32))
+
+def group_boxes(boxes, neighbours, eps=0.2):
+	'''
+	Merge boxes that cover the same target, the way detectMultiScale merges
+	its raw hits (same eps). Overlapping crops around nearby coarse candidates
+	refine to the same target, and only one box should come out. Each merged
+	box keeps the largest neighbour count of the boxes it replaced.
+	'''
+	if len(boxes) < 2:
+		return boxes, neighbours
+	# every box listed twice so groups of one survive the threshold of 1
+	merged, weights = cv2.groupRectangles(boxes.tolist() * 2, 1, eps)
+	merged = np.array(merged, dtype=np.int32).reshape(-1, 4)
+	centers = boxes[:,:2] + boxes[:,2:] / 2.0
+	merged_centers = merged[:,:2] + merged[:,2:] / 2.0
+	owner = np.argmin(np.linalg.norm(centers[:,None] - merged_centers[None], axis=2), axis=1)
+	counts = [neighbours[owner == i].max() if np.any(owner == i) else 0 for i in range(len(merged))]
+	return merged, np.array(counts, dtype=np.int32)
+
+def get_marker_detector():
+	'''
+	Build the AprilTag 36h11 dictionary and detector parameters once per process
+	and return a function gray -> (corners, ids, rejected).
+	'''
+	global marker_detector
+	if marker_detector is None:
+		aruco = cv2.aruco
+		dictionary = aruco.getPredefinedDictionary(aruco.DICT_APRILTAG_36H11)
+		if hasattr(aruco, "ArucoDetector"):
+			marker_detector = aruco.ArucoDetector(dictionary, aruco.DetectorParameters()).detectMarkers
+		else:
+			parameters = aruco.DetectorParameters_create()
+			marker_detector = lambda gray: aruco.detectMarkers(gray, dictionary, parameters=parameters)
+	return marker_detector
+
+def get_diamond_detector():
+	'''
+	Build the ChArUco diamond detector once per process and return a function
+	(gray, corners, ids) -> (diamond_corners, diamond_ids).
+	'''
+	global diamond_detector
+	if diamond_detector is None:
+		aruco = cv2.aruco
+		if hasattr(aruco, "CharucoDetector"):
+			dictionary = aruco.getPredefinedDictionary(aruco.DICT_APRILTAG_36H11)
+			board = aruco.CharucoBoard((3, 3), diamond_square_size, marker_size, dictionary)
+			charuco = aruco.CharucoDetector(board)
+			diamond_detector = lambda gray, corners, ids: charuco.detectDiamonds(gray, markerCorners=corners, markerIds=ids)[:2]
+		else:
+			rate = diamond_square_size / marker_size
+			diamond_detector = lambda gray, corners, ids: aruco.detectCharucoDiamond(gray, corners, ids, rate)
+	return diamond_detector
+
+def estimate_marker_pose(corners, size=None, image_size=(hres, vres)):
+	'''
+	Return (rvec, tvec) of one square marker of the given side (marker_size by
+	default) in the camera frame, tvec in metres. image_size (width, height)
+	is that of the frame the corners were found in.
+	'''
+	if size is None:
+		size = marker_size
+	camera_matrix, dist_coeffs = calibration_store.intrinsics(tuple(image_size))
+	if hasattr(cv2.aruco, "estimatePoseSingleMarkers"):
+		rvecs, tvecs, _ = cv2.aruco.estimatePoseSingleMarkers([corners], size, camera_matrix, dist_coeffs)
+		return rvecs[0].reshape(3), tvecs[0].reshape(3)
+	half = size / 2.0
+	object_points = np.array([[-half, half, 0], [half, half, 0], [half, -half, 0], [-half, -half, 0]], dtype=np.float32)
+	ok, rvec, tvec = cv2.solvePnP(object_points, corners.reshape(4, 2), camera_matrix, dist_coeffs,
+	                              flags=cv2.SOLVEPNP_IPPE_SQUARE)
+	return rvec.reshape(3), tvec.reshape(3)
+
+def frame_marker_pose(corners, size, shape):
+	'''
+	estimate_marker_pose for corners found in a frame of the given shape, or
+	None when the calibration does not fit that frame (see calibration_store).
+	The center of a detection does not need it.
+	'''
+	try:
+		return estimate_marker_pose(corners, size, (shape[1], shape[0]))
+	except ValueError:
+		return None
+
+def detect_fiducial(img, location=None, attitude=None, window=None):
+	'''
+	AprilTag backend: (ms, center, target, pose), or (ms, None, None, None)
+	when no marker is found. center is that of the last marker (see
+	image_center), target its (x, y, w, h) boxes in full frame pixels and
+	pose (rvec, tvec) of the marker the center belongs to, None without a
+	calibration for the frame size.
+	'''
+	start = current_milli_time()
+	gray = img
+	if(len(gray.shape) == 3):
+		gray = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY)
+	if window is not None:
+		wx, wy, ww, wh = window
+		gray = gray[wy:wy+wh, wx:wx+ww]
+
+	corners, ids, rejected = get_marker_detector()(gray)
+	if ids is None or len(ids) == 0:
+		stop = current_milli_time()
+		return (stop-start, None, None, None)
+
+	if window is not None:
+		corners = [c + np.float32((wx, wy)) for c in corners]
+	target = np.array([cv2.boundingRect(c.reshape(4, 2)) for c in corners])
+	x_true, y_true = corners[-1].reshape(4, 2).mean(axis=0)
+	center = image_center(x_true, y_true, img.shape)
+	pose = frame_marker_pose(corners[-1], marker_size, img.shape)
+	stop = current_milli_time()
+	return (stop-start, center, target, pose)
+
+def detect_diamond(img, location=None, attitude=None, window=None):
+	'''
+	ChArUco diamond backend, same contract as detect_fiducial. The pose is that
+	of the whole diamond, which is larger and steadier than a single marker.
+	'''
+	start = current_milli_time()
+	gray = img
+	if(len(gray.shape) == 3):
+		gray = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY)
+	if window is not None:
+		wx, wy, ww, wh = window
+		gray = gray[wy:wy+wh, wx:wx+ww]
+
+	corners, ids, rejected = get_marker_detector()(gray)
+	diamonds = None
+	if ids is not None and len(ids) >= 4:
+		diamonds, diamond_ids = get_diamond_detector()(gray, corners, ids)
+	if diamonds is None or len(diamonds) == 0:
 		stop = current_milli_time()
-		child_conn.send((stop-start, None, None))
+		return (stop-start, None, None, None)
+
+	if window is not None:
+		diamonds = [c + np.float32((wx, wy)) for c in diamonds]
+	target = np.array([cv2.boundingRect(c.reshape(4, 2)) for c in diamonds])
+	x_true, y_true = diamonds[-1].reshape(4, 2).mean(axis=0)
+	center = image_center(x_true, y_true, img.shape)
+	pose = frame_marker_pose(diamonds[-1], diamond_square_size, img.shape)
+	stop = current_milli_time()
+	return (stop-start, center, target, pose)
+
+class RoiTracker(object):
+	'''
+	Search window for the next detection. After a hit the window is the last
+	box grown by margin box sizes on every side, and grown further with every
+	miss. After max_misses consecutive misses the full frame is searched again.
+	'''
+
+	def __init__(self, margin=1.0, max_misses=3):
+		self.margin = margin
+		self.max_misses = max_misses
+		self.box = None
+		self.misses = 0
+
+	def window(self, shape):
+		'''
+		Return the (x, y, w, h) window to search in a frame of the given shape,
+		or None for the full frame.
+		'''
+		if self.box is None:
+			return None
+		x, y, w, h = self.box
+		grow = int(self.margin * (1 + self.misses) * max(w, h))
+		x0 = max(0, x - grow)
+		y0 = max(0, y - grow)
+		x1 = min(shape[1], x + w + grow)
+		y1 = min(shape[0], y + h + grow)
+		return (x0, y0, x1 - x0, y1 - y0)
+
+	def update(self, target):
+		if target is not None and len(target) > 0:
+			self.box = tuple(int(v) for v in target[-1])
+			self.misses = 0
+		elif self.box is not None:
+			self.misses += 1
+			if self.misses >= self.max_misses:
+				self.box = None
+				self.misses = 0
+
+class FlowTracker(object):
+	'''
+	Carries a detected box from frame to frame with pyramidal Lucas-Kanade flow
+	on corners inside it, which is much cheaper than detectMultiScale. Points
+	that fail the forward-backward check (further than fb_threshold px from where
+	they started) are dropped. The box moves by the median point shift and
+	scales by the median change in point spacing, so it follows the target as
+	it grows during the descent.
+
+	needs_detection() asks for the detector again once fewer than min_points
+	(or less than min_fraction of the seeded points) survive, the box leaves
+	the frame, or refresh frames have been tracked since the last detection.
+	'''
+
+	def __init__(self, max_corners=40, min_points=8, min_fraction=0.5, fb_threshold=1.0, refresh=10,
+	             win_size=(15, 15), max_level=2):
+		self.max_corners = max_corners
+		self.min_points = min_points
+		self.min_fraction = min_fraction
+		self.fb_threshold = fb_threshold
+		self.refresh = refresh
+		self.lk_params = dict(winSize=win_size, maxLevel=max_level,
+		                      criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+		self.box = None
+		self.gray = None
+		self.points = None
+		self.seeded = 0
+		self.age = 0
+		self.tracked = 0
+		self.lost = 0
+
+	def needs_detection(self):
+		return self.box is None or self.age >= self.refresh
+
+	def start(self, img, target):
+		'''
+		Seed the tracker from the last box of a detection, or clear it when
+		nothing was found. Returns True if enough corners were found to track.
+		'''
+		self.box = None
+		if target is None or len(target) == 0:
+			return False
+		gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if len(img.shape) == 3 else img
+		x, y, w, h = [int(v) for v in target[-1]]
+		# corners near the box edge are as likely to be background as target
+		inset_x, inset_y = w // 10, h // 10
+		mask = np.zeros(gray.shape, dtype=np.uint8)
+		mask[max(0, y + inset_y):y + h - inset_y, max(0, x + inset_x):x + w - inset_x] = 255
+		points = cv2.goodFeaturesToTrack(gray, self.max_corners, 0.01, max(3, min(w, h) // 10), mask=mask)
+		if points is None or len(points) < self.min_points:
+			return False
+		self.gray = gray
+		self.points = points.astype(np.float32)
+		self.seeded = len(points)
+		self.box = np.array([x, y, w, h], dtype=np.float64)
+		self.age = 0
+		return True
+
+	def track(self, img):
+		'''
+		Move the box into img. Returns the (x, y, w, h) box as a 1x4 int array
+		like the detectors, or None if the track was lost.
+		'''
+		if self.box is None:
+			return None
+		gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if len(img.shape) == 3 else img
+		forward, status, err = cv2.calcOpticalFlowPyrLK(self.gray, gray, self.points, None, **self.lk_params)
+		backward, back_status, err = cv2.calcOpticalFlowPyrLK(gray, self.gray, forward, None, **self.lk_params)
+		error = np.abs(self.points - backward).reshape(-1, 2).max(axis=1)
+		good = (status.ravel() == 1) & (back_status.ravel() == 1) & (error < self.fb_threshold)
+		count = int(good.sum())
+		if count < self.min_points or count < self.min_fraction * self.seeded:
+			return self.lose()
+
+		old = self.points[good].reshape(-1, 2)
+		new = forward[good].reshape(-1, 2)
+		shift = np.median(new - old, axis=0)
+		i, j = np.triu_indices(count, 1)
+		old_spacing = np.hypot(*(old[i] - old[j]).T)
+		new_spacing = np.hypot(*(new[i] - new[j]).T)
+		valid = old_spacing > 1.0
+		scale = float(np.median(new_spacing[valid] / old_spacing[valid])) if valid.any() else 1.0
+
+		x, y, w, h = self.box
+		cx, cy = x + w / 2.0 + shift[0], y + h / 2.0 + shift[1]
+		w, h = w * scale, h * scale
+		self.box = np.array([cx - w / 2.0, cy - h / 2.0, w, h])
+		if cx < 0 or cy < 0 or cx >= gray.shape[1] or cy >= gray.shape[0]:
+			return self.lose()
+
+		self.gray = gray
+		self.points = forward[good].reshape(-1, 1, 2)
+		self.age += 1
+		self.tracked += 1
+		return np.array([np.round(self.box).astype(int)])
+
+	def lose(self):
+		self.box = None
+		self.lost += 1
+		return None
+
+	def stats(self):
+		return "Flow tracker: %d frames tracked, %d tracks lost" % (self.tracked, self.lost)
 
 def add_target_highlights(image, target):
 	img = copy(image)
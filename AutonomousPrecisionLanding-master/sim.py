@@ -14,14 +14,15 @@ import numpy as np
 import math
 import time
 import os
+import collections
 
 #Dronekit Imports
 from dronekit import VehicleMode, Attitude, connect, LocationGlobalRelative
-from dronekit_sitl import SITL
 
 #Common Library Imports
 from position_vector import PositionVector
 import flight_assist as flightAssist
+import camera_model
 
 #List of global variables
 targetLocation = PositionVector()
@@ -29,13 +30,19 @@ vehicleLocation = PositionVector()
 vehicleAttitude = 0
 backgroundColor = (74,88,109)
 filename = (os.path.dirname(os.path.realpath(__file__)))+"/Resources/target.PNG"
+background_file = (os.path.dirname(os.path.realpath(__file__)))+"/Resources/bg.jpg"
+background = None #ground texture at camera resolution, see load_background
 target_size = 1.5
 camera_width = 640
 camera_height = 480
-camera_vfov = 60
-camera_hfov = 60
-camera_fov = math.sqrt(camera_vfov**2 + camera_hfov**2)
+camera_vfov = camera_model.vfov
+camera_hfov = camera_model.hfov
+camera_fov = (camera_hfov, camera_vfov) #projected per axis, so the rendered frame spans exactly these angles
 camera_frameRate = 30
+realtime = True #get_frame holds camera_frameRate, False renders as fast as possible
+frame_deadline = None
+render_cache = None #RenderCache get_frame reuses frames from, see enable_render_cache
+min_cached_alt = 0.5 #metres, below this frames are always rendered
 current_milli_time = lambda: int(round(time.time() * 1000))
 
 def load_target(filename, actualS=1.5):
@@ -47,6 +54,25 @@ def load_target(filename, actualS=1.5):
 	actualSize = actualS
 	global pixels_per_meter
 	pixels_per_meter = (target_height + target_width) / (2.0 * actualSize)
+	if render_cache is not None:
+		render_cache.clear()
+
+def load_background(filename=background_file):
+	'''
+	Decode and scale the ground texture once; simulate_target then composites
+	the target onto it instead of a flat colour. None goes back to the flat
+	colour.
+	'''
+	global background
+	if filename is None:
+		background = None
+		return
+	image = cv2.imread(filename)
+	if image is None:
+		raise IOError("Could not read background " + filename)
+	background = cv2.resize(image, (camera_width, camera_height), interpolation=cv2.INTER_AREA)
+	if render_cache is not None:
+		render_cache.clear()
 
 def set_target_location(location):
 	targetLocation.set_from_location(location)
@@ -56,60 +82,252 @@ def project_3D_to_2D(thetaX,thetaY,thetaZ, aX, aY,aZ, cX, cY, cZ, height, width,
 	dY = math.sin(-thetaX) * (math.cos(-thetaY)*(aZ-cZ) + math.sin(-thetaY)*(math.sin(-thetaZ)*(cY-aY) + math.cos(-thetaZ)*(cX-aX))) + math.cos(-thetaX)*(math.cos(-thetaZ)*(cY-aY) - math.sin(-thetaZ) * (cX-aX))
 	dZ = math.cos(-thetaX) * (math.cos(-thetaY)*(aZ-cZ) + math.sin(-thetaY)*(math.sin(-thetaZ)*(cY-aY) + math.cos(-thetaZ)*(cX-aX))) - math.sin(-thetaX)*(math.cos(-thetaZ)*(cY-aY) - math.sin(-thetaZ) * (cX-aX))
 
+	# fov is (horizontal, vertical) in degrees, the image edges are at +-1
 	eX = 0
 	eY = 0
-	eZ = 1.0/math.tan(math.radians(fov)/2.0)
+	fX = 1.0/math.tan(math.radians(fov[0])/2.0)
+	fY = 1.0/math.tan(math.radians(fov[1])/2.0)
 
-	bX = (dX - eX)*(eZ/dZ)
-	bY = (dY - eY)*(eZ/dZ)
+	bX = (dX - eX)*(fX/dZ)
+	bY = (dY - eY)*(fY/dZ)
 
-	sX = bX * width
-	sY = bY * height
+	sX = bX * width/2.0
+	sY = bY * height/2.0
 
 	return (sX,sY)
 
+def rotation_matrix(thetaX, thetaY, thetaZ):
+	'''
+	Rotation applied by project_3D_to_2D, computed once per frame: yaw, then
+	roll, then pitch, all negated.
+	'''
+	sx, cx = math.sin(-thetaX), math.cos(-thetaX)
+	sy, cy = math.sin(-thetaY), math.cos(-thetaY)
+	sz, cz = math.sin(-thetaZ), math.cos(-thetaZ)
+	# Rx(pitch) . Ry(roll) . Rz(yaw) multiplied out
+	return np.array([[cy*cz, cy*sz, -sy],
+	                 [sx*sy*cz - cx*sz, cx*cz + sx*sy*sz, sx*cy],
+	                 [cx*sy*cz + sx*sz, cx*sy*sz - sx*cz, cx*cy]])
+
+def project_points(R, aX, aY, aZ, points, height, width, fov):
+	'''
+	project_3D_to_2D for an (N, 3) array of (cX, cY, cZ) points at once, with
+	R from rotation_matrix. Returns an (N, 2) array of (sX, sY).
+	'''
+	relative = np.asarray(points, dtype=np.float64).reshape(-1, 3) - (aX, aY, aZ)
+	relative[:,2] *= -1
+	d = relative.dot(R.T)
+	focal = (width/2.0/math.tan(math.radians(fov[0])/2.0), height/2.0/math.tan(math.radians(fov[1])/2.0))
+	return d[:,:2] / d[:,2:3] * focal
+
 def shift_to_image(pt,width,height):
 	return ((pt[0] + width/2),(-1*pt[1] + height/2.0))
 
-def simulate_target(thetaX,thetaY,thetaZ, aX, aY, aZ, cX, cY, cZ, camera_height, camera_width, fov):
+def target_transform(thetaX,thetaY,thetaZ, aX, aY, aZ, cX, cY, cZ, camera_height, camera_width, fov):
+	'''
+	Return the perspective transform that maps target image pixels onto the camera image.
+	'''
 	img_width = target_width
 	img_height = target_height
 	corners = np.float32([[-img_width/2,img_height/2],[img_width/2 ,img_height/2],[-img_width/2,-img_height/2],[img_width/2, -img_height/2]])
-	newCorners = np.float32([[0,0],[0,0],[0,0],[0,0]])
-	for i in range(0,len(corners)):
-		x = corners[i][0] + cX - img_width/2.0
-		y = corners[i][1] + cY - img_height/2.0
-		x , y = project_3D_to_2D(thetaX,thetaY,thetaZ, aY, aX, aZ, y, x, cZ,camera_height,camera_width,fov)
-		x , y = shift_to_image((x,y),camera_width,camera_height)
-		newCorners[i] = x,y  
+	# project_3D_to_2D is called with x/y swapped for both the vehicle and the corners
+	points = np.empty((len(corners), 3))
+	# in float64: vehicle coordinates are ~1e9 pixels from home, where float32 steps are 64 pixels
+	points[:,0] = corners[:,1].astype(np.float64) + (cY - img_height/2.0)
+	points[:,1] = corners[:,0].astype(np.float64) + (cX - img_width/2.0)
+	points[:,2] = cZ
+	projected = project_points(rotation_matrix(thetaX, thetaY, thetaZ), aY, aX, aZ, points,
+	                           camera_height, camera_width, fov)
+	newCorners = np.float32(projected * (1, -1) + (camera_width/2.0, camera_height/2.0))
 
-	M = cv2.getPerspectiveTransform(corners,newCorners)
+	return cv2.getPerspectiveTransform(corners,newCorners)
 
-	#im = cv2.imread("Resources/bg.jpg")
-	#im = cv2.resize(im, (640,480))
-	sim = cv2.warpPerspective(target,M,(640, 480),borderValue=(74,88,109))
+def target_ground_truth(M):
+	'''
+	Return (center, corners) of the rendered target in camera image pixels.
+	'''
+	points = np.float32([[target_width/2.0, target_height/2.0], [0,0], [target_width,0], [target_width,target_height], [0,target_height]])
+	projected = cv2.perspectiveTransform(points.reshape(-1,1,2), M).reshape(-1,2)
+	return projected[0], projected[1:]
+
+def simulate_target(thetaX,thetaY,thetaZ, aX, aY, aZ, cX, cY, cZ, camera_height, camera_width, fov, out=None):
+	M = target_transform(thetaX,thetaY,thetaZ, aX, aY, aZ, cX, cY, cZ, camera_height, camera_width, fov)
+
+	if background is not None:
+		return composite_target(M, camera_height, camera_width, out)
+	sim = cv2.warpPerspective(target,M,(camera_width, camera_height),dst=out,borderValue=backgroundColor)
 
 	return sim
 
-def get_frame(vehicleAttitude):
-	start = current_milli_time()
+def composite_target(M, camera_height, camera_width, out=None):
+	'''
+	Draw the target over the background. Only the target's bounding box is
+	warped; pixels in it that the target does not cover keep the background.
+	'''
+	if out is None:
+		out = np.empty((camera_height, camera_width, 3), dtype=np.uint8)
+	out[:] = background
+	corners = np.float32([[0,0], [target_width,0], [target_width,target_height], [0,target_height]])
+	projected = cv2.perspectiveTransform(corners.reshape(-1,1,2), M).reshape(-1,2)
+	x0, y0 = np.maximum(np.floor(projected.min(axis=0)).astype(int), 0)
+	x1, y1 = np.minimum(np.ceil(projected.max(axis=0)).astype(int) + 1, (camera_width, camera_height))
+	if x1 <= x0 or y1 <= y0:
+		return out
+	# shift the transform so the box starts at the origin
+	shift = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], dtype=np.float64)
+	patch = out[y0:y1, x0:x1].copy()
+	cv2.warpPerspective(target, shift.dot(M), (x1 - x0, y1 - y0), dst=patch, borderMode=cv2.BORDER_TRANSPARENT)
+	out[y0:y1, x0:x1] = patch
+	return out
+
+class RenderCache(object):
+	'''
+	LRU cache of rendered frames keyed by the quantized pose of the vehicle
+	relative to the target. The lateral offset is quantized as a fraction of
+	the altitude and the altitude on a log scale, so a hit is off by about the
+	same number of pixels at every height. A miss renders the pose in the
+	middle of its bucket, so what a key returns does not depend on the order
+	frames were asked for in. Least recently used frames are dropped once
+	they take more than max_bytes.
+	'''
+
+	def __init__(self, max_bytes=256*1024*1024, lateral_step=0.002, altitude_step=0.005, angle_step=math.radians(0.1)):
+		self.max_bytes = max_bytes
+		self.lateral_step = lateral_step
+		self.altitude_step = altitude_step
+		self.angle_step = angle_step
+		self.frames = collections.OrderedDict()
+		self.bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def key(self, north, east, alt, pitch, roll, yaw):
+		return (int(round(north / alt / self.lateral_step)), int(round(east / alt / self.lateral_step)),
+		        int(round(math.log(alt) / self.altitude_step)), int(round(pitch / self.angle_step)),
+		        int(round(roll / self.angle_step)), int(round(yaw / self.angle_step)))
+
+	def pose(self, key):
+		'''
+		(north, east, alt, pitch, roll, yaw) in the middle of the key's bucket.
+		'''
+		alt = math.exp(key[2] * self.altitude_step)
+		return (key[0] * self.lateral_step * alt, key[1] * self.lateral_step * alt, alt,
+		        key[3] * self.angle_step, key[4] * self.angle_step, key[5] * self.angle_step)
+
+	def get(self, key):
+		frame = self.frames.get(key)
+		if frame is None:
+			self.misses += 1
+			return None
+		self.frames.move_to_end(key)
+		self.hits += 1
+		return frame
+
+	def put(self, key, frame):
+		if frame.nbytes > self.max_bytes:
+			return
+		old = self.frames.pop(key, None)
+		if old is not None:
+			self.bytes -= old.nbytes
+		self.frames[key] = frame
+		self.bytes += frame.nbytes
+		while self.bytes > self.max_bytes:
+			_, evicted = self.frames.popitem(last=False)
+			self.bytes -= evicted.nbytes
+			self.evictions += 1
+
+	def clear(self):
+		self.frames.clear()
+		self.bytes = 0
+
+	def stats(self):
+		lookups = self.hits + self.misses
+		return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "frames": len(self.frames),
+		        "bytes": self.bytes, "hit_rate": round(self.hits / float(lookups), 4) if lookups else None}
+
+def enable_render_cache(max_bytes=256*1024*1024, **kwargs):
+	'''
+	Let get_frame reuse frames rendered for nearly the same relative pose,
+	see RenderCache for kwargs. max_bytes of 0 or None turns it off again.
+	Returns the cache.
+	'''
+	global render_cache
+	render_cache = RenderCache(max_bytes, **kwargs) if max_bytes else None
+	return render_cache
+
+def cached_target(thetaX, thetaY, thetaZ, north, east, alt, out=None):
+	'''
+	simulate_target through render_cache, for the vehicle alt metres above
+	and north/east metres from the target. The frame returned is always the
+	caller's to draw on.
+	'''
+	key = render_cache.key(north, east, alt, thetaX, thetaY, thetaZ)
+	frame = render_cache.get(key)
+	if frame is None:
+		north, east, alt, thetaX, thetaY, thetaZ = render_cache.pose(key)
+		frame = simulate_target(thetaX, thetaY, thetaZ, north * pixels_per_meter, east * pixels_per_meter, 0, 0, 0,
+		                        alt * pixels_per_meter, camera_height, camera_width, camera_fov)
+		render_cache.put(key, frame)
+	if out is None:
+		return frame.copy()
+	np.copyto(out, frame)
+	return out
+
+def set_realtime(enabled):
+	'''
+	Pace get_frame to camera_frameRate (the default), or return every frame
+	as soon as it is rendered for batch simulation.
+	'''
+	global realtime, frame_deadline
+	realtime = enabled
+	frame_deadline = None
+
+def wait_for_frame_slot():
+	'''
+	Sleep until the next frame is due. Deadlines advance by one period per
+	frame, so the rate holds across calls no matter how long rendering and
+	the caller took; after falling more than a frame behind the schedule is
+	restarted instead of bursting to catch up.
+	'''
+	global frame_deadline
+	period = 1.0 / camera_frameRate
+	now = time.monotonic()
+	if frame_deadline is None or now - frame_deadline > period:
+		frame_deadline = now
+	elif frame_deadline > now:
+		time.sleep(frame_deadline - now)
+	frame_deadline += period
+
+def get_frame(vehicleAttitude, out=None, trace=None):
+	'''
+	Render the target as seen from the current vehicle location. trace, a
+	latency_trace.FrameTrace, is stamped with the capture time right before
+	rendering, after the frame slot wait.
+	'''
+	if realtime:
+		wait_for_frame_slot()
+	if trace is not None:
+		trace.mark("capture")
 	aX,aY,aZ = targetLocation.x, targetLocation.y, targetLocation.z
 	cX,cY,cZ = vehicleLocation.x, vehicleLocation.y, vehicleLocation.z
 
 	thetaX = vehicleAttitude.pitch
 	thetaY = vehicleAttitude.roll
 	thetaZ = vehicleAttitude.yaw
-	aX = aX * pixels_per_meter
-	aY = aY * pixels_per_meter
-	aZ = aZ * pixels_per_meter
-	cX = cX * pixels_per_meter
-	cY = cY * pixels_per_meter
-	cZ = cZ * pixels_per_meter
-
-	sim = simulate_target(thetaX,thetaY,thetaZ, aX, aY, aZ, cX, cY, cZ, camera_height, camera_width, camera_fov)
-	
-	while(1000/camera_frameRate > current_milli_time() - start):
-		pass
+
+	if render_cache is not None and cZ - aZ > min_cached_alt:
+		sim = cached_target(thetaX, thetaY, thetaZ, aX - cX, aY - cY, cZ - aZ, out)
+	else:
+		aX = aX * pixels_per_meter
+		aY = aY * pixels_per_meter
+		aZ = aZ * pixels_per_meter
+		cX = cX * pixels_per_meter
+		cY = cY * pixels_per_meter
+		cZ = cZ * pixels_per_meter
+
+		sim = simulate_target(thetaX,thetaY,thetaZ, aX, aY, aZ, cX, cY, cZ, camera_height, camera_width, camera_fov, out)
+
 	return sim
 
 def refresh_simulator(vehicleLoc, vehicleAtt):
@@ -117,6 +335,8 @@ def refresh_simulator(vehicleLoc, vehicleAtt):
 	vehicleAttitude = vehicleAtt
 
 if __name__ == '__main__':
+	# only needed to fly against SITL, importing sim for offline runs must not require it
+	from dronekit_sitl import SITL
 	load_target(filename, target_size)
 	sitl = SITL()
 	sitl.download('copter', '3.3', verbose=True)
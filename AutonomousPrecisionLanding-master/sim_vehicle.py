@@ -0,0 +1,178 @@
+'''
+
+	Synopsis: In-process stand-in for a dronekit Vehicle. It exposes the parts of the
+	vehicle the landing code uses and integrates simple multicopter kinematics on its
+	own clock, so closed-loop landings run offline and faster than real time instead
+	of against SITL.
+
+'''
+
+#Python Imports
+import math
+
+#Dronekit Imports
+from dronekit import VehicleMode, LocationGlobalRelative, Attitude
+from pymavlink import mavutil
+
+#Common Library Imports
+import position_vector
+
+gravity = 9.81
+
+class SimMessage(object):
+	'''
+	What the message factory encodes: just enough to apply it in send_mavlink.
+	'''
+	__slots__ = ("kind", "frame", "command", "params")
+
+	def __init__(self, kind, frame=None, command=None, params=()):
+		self.kind = kind
+		self.frame = frame
+		self.command = command
+		self.params = params
+
+class SimMessageFactory(object):
+
+	def set_position_target_local_ned_encode(self, time_boot_ms, target_system, target_component, frame, type_mask,
+	                                         x, y, z, vx, vy, vz, afx, afy, afz, yaw, yaw_rate):
+		return SimMessage("velocity", frame, params=(vx, vy, vz))
+
+	def command_long_encode(self, target_system, target_component, command, confirmation, *params):
+		return SimMessage("command", command=command, params=params)
+
+class SimLocation(object):
+
+	def __init__(self, vehicle):
+		self.vehicle = vehicle
+
+	@property
+	def global_relative_frame(self):
+		return self.vehicle.global_relative_frame()
+
+class SimVehicle(object):
+	'''
+	Point-mass copter in a local north/east/up frame around home. Velocity
+	setpoints are followed with a first order lag of time_constant seconds and
+	at most max_accel m/s^2; pitch and roll are the tilt that acceleration
+	needs. Like ArduCopter a velocity setpoint is dropped after
+	setpoint_timeout seconds without a new one, and LAND descends at
+	land_speed and disarms on the ground.
+
+	Nothing moves until step() is called; clock() is the simulated time.
+	'''
+
+	def __init__(self, home=None, time_constant=0.5, max_accel=3.0, max_climb=2.5, land_speed=0.5,
+	             setpoint_timeout=3.0):
+		if home is None:
+			# same home as the SITL instance main.py starts
+			home = LocationGlobalRelative(-35.363261, 149.165230, 0)
+		self.home = home
+		self.time_constant = time_constant
+		self.max_accel = max_accel
+		self.max_climb = max_climb
+		self.land_speed = land_speed
+		self.setpoint_timeout = setpoint_timeout
+		self.time = 0.0
+		self.position = [0.0, 0.0, 0.0]
+		self.velocity = [0.0, 0.0, 0.0]
+		self.accel = [0.0, 0.0, 0.0]
+		self.yaw = 0.0
+		self.target_yaw = 0.0
+		self.setpoint = None
+		self.setpoint_time = 0.0
+		self.takeoff_alt = None
+		self._mode = VehicleMode("STABILIZE")
+		self.armed = False
+		self.is_armable = True
+		self.location = SimLocation(self)
+		self.message_factory = SimMessageFactory()
+
+	def clock(self):
+		return self.time
+
+	@property
+	def mode(self):
+		return self._mode
+
+	@mode.setter
+	def mode(self, mode):
+		self._mode = mode if isinstance(mode, VehicleMode) else VehicleMode(mode)
+
+	@property
+	def attitude(self):
+		north, east = self.accel[0], self.accel[1]
+		forward = north * math.cos(self.yaw) + east * math.sin(self.yaw)
+		right = -north * math.sin(self.yaw) + east * math.cos(self.yaw)
+		return Attitude(-math.atan2(forward, gravity), self.yaw, math.atan2(right, gravity))
+
+	def global_relative_frame(self):
+		north, east, up = self.position
+		lat = self.home.lat + north / position_vector.posvec_latlon_to_m
+		lon = self.home.lon + east / (position_vector.posvec_latlon_to_m * position_vector.posvec_lon_scale)
+		return LocationGlobalRelative(lat, lon, up)
+
+	def simple_takeoff(self, alt):
+		if self.armed:
+			self.takeoff_alt = alt
+
+	def send_mavlink(self, msg):
+		if msg.kind == "velocity":
+			vx, vy, vz = msg.params
+			if msg.frame == mavutil.mavlink.MAV_FRAME_BODY_OFFSET_NED:
+				# body forward/right into north/east
+				vx, vy = (vx * math.cos(self.yaw) - vy * math.sin(self.yaw),
+				          vx * math.sin(self.yaw) + vy * math.cos(self.yaw))
+			self.setpoint = (vx, vy, -vz)
+			self.setpoint_time = self.time
+			self.takeoff_alt = None
+		elif msg.kind == "command" and msg.command == mavutil.mavlink.MAV_CMD_CONDITION_YAW:
+			heading, speed, direction, relative = msg.params[:4]
+			heading = math.radians(heading)
+			self.target_yaw = self.yaw + direction * heading if relative else heading
+
+	def commanded_velocity(self):
+		if not self.armed:
+			return (0.0, 0.0, 0.0)
+		if self._mode == "LAND":
+			return (0.0, 0.0, -self.land_speed)
+		if self.takeoff_alt is not None:
+			return (0.0, 0.0, min(self.max_climb, max(0.0, self.takeoff_alt - self.position[2])))
+		if self._mode == "GUIDED" and self.setpoint is not None and self.time - self.setpoint_time <= self.setpoint_timeout:
+			return self.setpoint
+		return (0.0, 0.0, 0.0)
+
+	def step(self, dt):
+		'''
+		Advance the simulation by dt seconds.
+		'''
+		target = self.commanded_velocity()
+		for i in range(3):
+			accel = (target[i] - self.velocity[i]) / max(self.time_constant, dt)
+			self.accel[i] = max(-self.max_accel, min(self.max_accel, accel))
+			self.velocity[i] += self.accel[i] * dt
+			self.position[i] += self.velocity[i] * dt
+		if self.position[2] <= 0.0:
+			self.position[2] = 0.0
+			self.velocity[2] = max(0.0, self.velocity[2])
+			if self._mode == "LAND" and self.armed:
+				self.armed = False
+				self.velocity = [0.0, 0.0, 0.0]
+				self.accel = [0.0, 0.0, 0.0]
+		yaw_error = math.atan2(math.sin(self.target_yaw - self.yaw), math.cos(self.target_yaw - self.yaw))
+		self.yaw += max(-math.radians(90) * dt, min(math.radians(90) * dt, yaw_error))
+		self.time += dt
+
+	def run_until(self, condition, dt=0.05, timeout=120.0):
+		'''
+		Step until condition() holds or timeout simulated seconds have passed.
+		Returns whether the condition was met.
+		'''
+		end = self.time + timeout
+		while not condition():
+			if self.time >= end:
+				return False
+			self.step(dt)
+		return True
+
+	def close(self):
+		pass
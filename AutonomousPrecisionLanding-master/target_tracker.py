@@ -0,0 +1,172 @@
+'''
+
+	Synopsis: Constant-velocity Kalman filter over the target center in the image. Fed
+	by detections and propagated with the vehicle attitude, it fills in the frames the
+	detector skips or misses and gates detections that do not fit the track.
+
+'''
+
+#Python Imports
+import math
+import time
+
+#Opencv Imports
+import numpy as np
+
+#Common Library Imports
+import camera_model
+import search_image
+
+# focal lengths in pixels of search_image's reference frame, the unit detection centers
+# come in; a change in roll/pitch of d radians moves the image by about d*focal
+focal_x = (search_image.hres/2.0) / math.tan(math.radians(camera_model.hfov/2.0))
+focal_y = (search_image.vres/2.0) / math.tan(math.radians(camera_model.vfov/2.0))
+
+class KalmanTracker(object):
+	'''
+	State is (x, y, vx, vy) in pixels and pixels/s, in the search_image convention
+	(relative to the middle of the image, y up) so estimate() can go straight to
+	control.land.
+
+	process_noise is the acceleration spectral density in px^2/s^3, measurement_noise
+	the detector's standard deviation in px. Detections further than gate (squared
+	Mahalanobis distance, 9.21 is the 99% bound for 2 dof) from the prediction are
+	rejected; after max_rejects rejections in a row the track is restarted on the next
+	detection. estimate() gives up once the track has coasted for max_coast seconds.
+	'''
+
+	def __init__(self, process_noise=2000.0, measurement_noise=8.0, initial_velocity=100.0, gate=9.21,
+	             max_coast=1.0, max_rejects=3):
+		self.process_noise = process_noise
+		self.measurement_noise = measurement_noise
+		self.initial_velocity = initial_velocity
+		self.gate = gate
+		self.max_coast = max_coast
+		self.max_rejects = max_rejects
+		self.H = np.array([[1.0, 0, 0, 0], [0, 1.0, 0, 0]])
+		self.R = np.eye(2) * measurement_noise**2
+		self.updates = 0
+		self.rejected = 0
+		self.reset()
+
+	def reset(self):
+		self.x = None
+		self.P = None
+		self.last_time = None
+		self.last_update = None
+		self.last_attitude = None
+		self.rejects = 0
+
+	@property
+	def active(self):
+		return self.x is not None
+
+	def compensate(self, attitude):
+		'''
+		Move the state by the image motion the change in attitude since the last
+		call causes, so only the vehicle's translation is left for the motion model.
+		'''
+		if attitude is None:
+			return
+		if self.last_attitude is not None and self.x is not None:
+			roll = attitude.roll - self.last_attitude.roll
+			pitch = attitude.pitch - self.last_attitude.pitch
+			yaw = math.atan2(math.sin(attitude.yaw - self.last_attitude.yaw),
+			                 math.cos(attitude.yaw - self.last_attitude.yaw))
+			c, s = math.cos(yaw), math.sin(yaw)
+			rotate = np.array([[c, -s], [s, c]])
+			self.x[:2] = rotate.dot(self.x[:2]) + (focal_x * roll, -focal_y * pitch)
+			self.x[2:] = rotate.dot(self.x[2:])
+			T = np.eye(4)
+			T[:2, :2] = rotate
+			T[2:, 2:] = rotate
+			self.P = T.dot(self.P).dot(T.T)
+		self.last_attitude = attitude
+
+	def predict(self, now=None, attitude=None):
+		'''
+		Propagate the track to now (time.monotonic() if not given). Returns the
+		predicted center or None without a track.
+		'''
+		if now is None:
+			now = time.monotonic()
+		self.compensate(attitude)
+		if self.x is None:
+			self.last_time = now
+			return None
+		dt = max(0.0, now - self.last_time)
+		self.last_time = now
+		F = np.eye(4)
+		F[0, 2] = F[1, 3] = dt
+		q = self.process_noise
+		Q = np.zeros((4, 4))
+		Q[0, 0] = Q[1, 1] = q * dt**3 / 3.0
+		Q[0, 2] = Q[2, 0] = Q[1, 3] = Q[3, 1] = q * dt**2 / 2.0
+		Q[2, 2] = Q[3, 3] = q * dt
+		self.x = F.dot(self.x)
+		self.P = F.dot(self.P).dot(F.T) + Q
+		return (self.x[0], self.x[1])
+
+	def innovation(self, center):
+		'''
+		Returns the innovation, its covariance and the squared Mahalanobis distance
+		of center from the current prediction.
+		'''
+		y = np.asarray(center, dtype=np.float64) - self.H.dot(self.x)
+		S = self.H.dot(self.P).dot(self.H.T) + self.R
+		return y, S, float(y.dot(np.linalg.solve(S, y)))
+
+	def update(self, center, now=None):
+		'''
+		Fold a detection into the track, call predict() for the same frame first.
+		Returns False if the detection was gated out.
+		'''
+		if now is None:
+			now = time.monotonic()
+		if self.x is None:
+			self.x = np.array([center[0], center[1], 0.0, 0.0], dtype=np.float64)
+			self.P = np.diag([self.measurement_noise**2] * 2 + [self.initial_velocity**2] * 2)
+			self.last_time = self.last_update = now
+			self.updates += 1
+			return True
+		y, S, distance = self.innovation(center)
+		if distance > self.gate:
+			self.rejected += 1
+			self.rejects += 1
+			if self.rejects >= self.max_rejects:
+				# the track has most likely been lost, let the next detection restart it
+				attitude = self.last_attitude
+				self.reset()
+				self.last_attitude = attitude
+			return False
+		K = self.P.dot(self.H.T).dot(np.linalg.inv(S))
+		self.x = self.x + K.dot(y)
+		self.P = (np.eye(4) - K.dot(self.H)).dot(self.P)
+		self.last_update = now
+		self.rejects = 0
+		self.updates += 1
+		return True
+
+	def estimate(self, now=None):
+		'''
+		Current center for control, or None without a track or once it has
+		coasted longer than max_coast.
+		'''
+		if self.x is None:
+			return None
+		if now is None:
+			now = time.monotonic()
+		if now - self.last_update > self.max_coast:
+			return None
+		return (float(self.x[0]), float(self.x[1]))
+
+	def covariance(self):
+		'''
+		2x2 position covariance in px^2, None without a track.
+		'''
+		if self.x is None:
+			return None
+		return self.P[:2, :2].copy()
+
+	def stats(self):
+		return "Tracker: %d detections used, %d gated out" % (self.updates, self.rejected)
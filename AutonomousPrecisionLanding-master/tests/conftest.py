@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the flight code is a flat directory of modules imported by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
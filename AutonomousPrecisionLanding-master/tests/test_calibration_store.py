@@ -0,0 +1,81 @@
+import json
+
+import numpy as np
+import pytest
+
+import calibration_store
+import camera_model
+
+matrix = np.array([[800.0, 0.0, 320.0], [0.0, 790.0, 240.0], [0.0, 0.0, 1.0]])
+dist = np.array([-0.1, 0.05, 0.0, 0.0, 0.0])
+
+
+@pytest.fixture
+def saved(tmp_path):
+	'''
+	Save into a temporary file; the loaders are cached so they are cleared on
+	the way out too.
+	'''
+	def save(image_size):
+		path = str(tmp_path / "calibration.json")
+		calibration_store.save(matrix, dist, image_size, 0.3, path=path)
+		return path
+	yield save
+	calibration_store.load.cache_clear()
+	calibration_store.intrinsics.cache_clear()
+
+
+def test_scale_intrinsics_follows_the_resize():
+	scaled = calibration_store.scale_intrinsics(matrix, (640, 480), (200, 150))
+	assert np.allclose(scaled[0], matrix[0] * 200 / 640.0)
+	assert np.allclose(scaled[1], matrix[1] * 150 / 480.0)
+	assert np.allclose(scaled[2], matrix[2])
+
+
+def test_scale_intrinsics_refuses_another_aspect_ratio():
+	with pytest.raises(ValueError):
+		calibration_store.scale_intrinsics(matrix, (1280, 720), (640, 480))
+
+
+def test_round_trip(saved):
+	path = saved((640, 480))
+	calibration = calibration_store.load(path)
+	assert calibration.image_size == (640, 480)
+	assert calibration.rms == 0.3
+	assert np.allclose(calibration.camera_matrix, matrix)
+	assert np.allclose(calibration.dist_coeffs, dist)
+	camera_matrix, dist_coeffs = calibration_store.intrinsics((320, 240), path)
+	assert np.allclose(camera_matrix[:2], matrix[:2] / 2.0)
+
+
+def test_principal_point_must_fit_the_frame():
+	# a matrix made at 1280x720 rescaled as if it were made at 320x180
+	wide = np.array([[965.0, 0.0, 527.5], [0.0, 962.5, 358.2], [0.0, 0.0, 1.0]])
+	with pytest.raises(ValueError):
+		calibration_store.scale_intrinsics(wide, (320, 180), (640, 360))
+
+
+def test_save_requires_the_image_size(tmp_path):
+	with pytest.raises(ValueError):
+		calibration_store.save(matrix, dist, None, path=str(tmp_path / "calibration.json"))
+
+
+def test_unknown_size_cannot_be_used(tmp_path):
+	path = str(tmp_path / "calibration.json")
+	with open(path, "w") as f:
+		json.dump({"version": calibration_store.version, "image_size": None, "camera_matrix": matrix.tolist(),
+		           "dist_coeffs": dist.tolist()}, f)
+	try:
+		assert calibration_store.load(path).image_size is None
+		with pytest.raises(ValueError):
+			calibration_store.intrinsics((200, 150), path)
+		with pytest.raises(ValueError):
+			camera_model.default_model(path)
+	finally:
+		calibration_store.load.cache_clear()
+
+
+def test_shipped_calibration_loads():
+	calibration = calibration_store.load()
+	assert calibration.camera_matrix.shape == (3, 3)
+	assert len(calibration.dist_coeffs) == 5
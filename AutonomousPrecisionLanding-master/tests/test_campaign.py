@@ -0,0 +1,65 @@
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip("dronekit")
+
+import campaign
+import control
+import sim
+
+settings = {"max_offset": 1.0, "altitudes": [5.0, 6.0], "attitude_noise": 0.01, "dropout": 0.1, "latency": 1,
+            "timeout": 60.0}
+
+
+def result(index, landed, error, time_to_land, hits=0, misses=0):
+	return {"index": index, "landed": landed, "error_m": error, "time_to_land_s": time_to_land,
+	        "render_hits": hits, "render_misses": misses}
+
+
+def test_summary_counts_only_landed_runs():
+	results = [result(2, True, 0.3, 40.0, 6, 2), result(0, True, 0.1, 20.0, 1, 3), result(1, False, 9.0, 120.0)]
+	summary = campaign.summarise(results, [1.0, 2.0, 3.0, 4.0])
+	assert summary["runs"] == 3
+	assert summary["landed"] == 2
+	assert summary["landed_rate"] == 0.6667
+	assert summary["landing_error_m"]["count"] == 2
+	assert summary["landing_error_m"]["max"] == 0.3
+	assert summary["time_to_land_s"]["p50"] == 30.0
+	assert summary["frame_compute_ms"]["mean"] == 2.5
+	assert summary["render_cache"] == {"hits": 7, "misses": 5, "hit_rate": 0.5833}
+	assert [r["index"] for r in summary["results"]] == [0, 1, 2]
+
+
+def test_summary_of_no_runs():
+	summary = campaign.summarise([], [])
+	assert summary["runs"] == 0
+	assert summary["landed_rate"] is None
+	assert summary["landing_error_m"] == {"count": 0}
+	assert summary["render_cache"]["hit_rate"] is None
+
+
+def test_conditions_depend_only_on_seed_and_index():
+	draw = lambda seed, index: campaign.sample(np.random.default_rng([seed, index]), settings)
+	assert draw(7, 3) == draw(7, 3)
+	assert draw(7, 3) != draw(7, 4)
+	assert draw(7, 3) != draw(8, 3)
+
+
+@pytest.fixture
+def worker():
+	campaign.init_worker("haar", {}, False, 0)
+	yield
+	sim.enable_render_cache(0)
+	sim.set_realtime(True)
+	control.verbose = True
+	cv2.setNumThreads(-1)
+
+
+def test_landing_is_reproducible_for_a_seed(worker):
+	first, compute = campaign.run_landing((0, 5, settings))
+	second, compute = campaign.run_landing((0, 5, settings))
+	assert first["landed"]
+	assert first["error_m"] < 1.0
+	for key in ("north", "east", "altitude", "error_m", "time_to_land_s", "frames", "detected"):
+		assert first[key] == second[key]
@@ -0,0 +1,61 @@
+import queue
+
+import numpy as np
+import pytest
+
+from detector_pool import DetectorPool
+import detectors
+
+
+def test_registry_only_lists_shipped_backends():
+	assert "lbp" not in detectors.available()
+	with pytest.raises(KeyError):
+		detectors.create("lbp")
+
+
+def test_detector_is_abstract():
+	with pytest.raises(TypeError):
+		detectors.Detector()
+
+
+def test_bad_cascade_fails_in_the_parent():
+	with pytest.raises(IOError):
+		DetectorPool(detector="haar", options={"cascade_file": "missing.xml"})
+
+
+def test_round_trip():
+	with DetectorPool() as pool:
+		seq = pool.submit(np.zeros((150, 200, 3), dtype=np.uint8), None, None)
+		got, detection, (start, end) = pool.get(timeout=10)
+		assert got == seq
+		assert not detection.found
+		assert start <= end
+		assert pool.pending == 0
+
+
+def test_get_times_out():
+	with DetectorPool() as pool:
+		with pytest.raises(queue.Empty):
+			pool.get(timeout=0.2)
+
+
+def test_dead_worker_raises_instead_of_hanging():
+	with DetectorPool() as pool:
+		pool.processes[0].terminate()
+		pool.processes[0].join()
+		pool.submit(np.zeros((150, 200, 3), dtype=np.uint8), None, None)
+		with pytest.raises(RuntimeError):
+			pool.get()
+
+
+def test_wait_drops_stale_results():
+	blank = np.zeros((150, 200, 3), dtype=np.uint8)
+	with DetectorPool() as pool:
+		# a result nobody collected, e.g. after a get that timed out
+		stale = pool.submit(blank, None, None)
+		seq = pool.submit(blank, None, None)
+		detection, (start, end) = pool.wait(seq, timeout=10)
+		assert seq != stale
+		assert pool.pending == 0
+		with pytest.raises(queue.Empty):
+			pool.get(timeout=0.2)
@@ -0,0 +1,90 @@
+import multiprocessing
+import pickle
+import threading
+
+import numpy as np
+import pytest
+
+from frame_ring import FrameRing
+
+@pytest.fixture
+def ring():
+	ring = FrameRing(slots=3, shape=(4, 5, 3))
+	yield ring
+	ring.close()
+
+def test_slots_are_handed_out_in_turn(ring):
+	assert [ring.acquire()[0] for i in range(3)] == [0, 1, 2]
+
+def test_full_ring_raises(ring):
+	for i in range(3):
+		ring.acquire()
+	with pytest.raises(RuntimeError):
+		ring.acquire()
+
+def test_released_slot_is_reused(ring):
+	for i in range(3):
+		ring.acquire()
+	ring.release(1)
+	index, frame = ring.acquire()
+	assert index == 1
+	assert frame.shape == (4, 5, 3)
+
+def test_busy_slot_is_skipped(ring):
+	first, _ = ring.acquire()
+	second, _ = ring.acquire()
+	ring.release(first)
+	# the ring moves on instead of going back to the slot just freed
+	assert ring.acquire()[0] == 2
+	assert ring.acquire()[0] == first
+
+def test_slot_is_a_view_of_the_frame_written(ring):
+	index, frame = ring.acquire()
+	frame[:] = 7
+	assert np.all(ring.slot(index) == 7)
+
+def read_slot(ring, index, result):
+	result.put(int(ring.slot(index).sum()))
+
+def test_pickled_ring_shares_memory(ring):
+	index, frame = ring.acquire()
+	frame[:] = 1
+	state = pickle.loads(pickle.dumps(ring))
+	assert not state.owner
+	assert np.all(state.slot(index) == 1)
+	state.close()
+
+	result = multiprocessing.Queue()
+	proc = multiprocessing.Process(target=read_slot, args=(ring, index, result))
+	proc.start()
+	assert result.get(timeout=10) == frame.size
+	proc.join()
+
+def test_threads_never_share_a_slot():
+	ring = FrameRing(slots=4, shape=(2, 2, 3))
+	held = set()
+	held_lock = threading.Lock()
+	errors = []
+
+	def stage():
+		for i in range(2000):
+			try:
+				index, frame = ring.acquire()
+			except RuntimeError:
+				continue
+			with held_lock:
+				if index in held:
+					errors.append(index)
+				held.add(index)
+			with held_lock:
+				held.discard(index)
+			ring.release(index)
+
+	threads = [threading.Thread(target=stage) for i in range(3)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	ring.close()
+	assert errors == []
+	assert ring.busy == set()
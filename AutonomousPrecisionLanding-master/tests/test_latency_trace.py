@@ -0,0 +1,34 @@
+import pytest
+
+from latency_trace import TraceRecorder
+
+def traced(recorder, **stamps):
+	trace = recorder.start()
+	for stage in ("capture", "enqueue", "detect_start", "detect_end", "control", "log_write"):
+		setattr(trace, stage, stamps.get(stage))
+	return trace
+
+def test_stage_latencies_in_ms():
+	recorder = TraceRecorder()
+	for i in range(10):
+		traced(recorder, capture=i, enqueue=i + 0.001, detect_start=i + 0.002, detect_end=i + 0.012,
+		       control=i + 0.013, log_write=i + 0.050)
+	summary = recorder.summary()
+	assert summary["frames"] == 10
+	assert summary["detection"]["count"] == 10
+	assert summary["detection"]["p50"] == pytest.approx(10.0, abs=0.01)
+	assert summary["capture_to_control"]["p99"] == pytest.approx(13.0, abs=0.01)
+	assert summary["detection_to_log"]["max"] == pytest.approx(38.0, abs=0.01)
+
+def test_frames_that_skip_a_stage_are_left_out_of_it_only():
+	recorder = TraceRecorder()
+	traced(recorder, capture=0.0, enqueue=0.001, detect_start=0.002, detect_end=0.003, control=0.004)
+	traced(recorder, capture=1.0, enqueue=1.001)
+	summary = recorder.summary()
+	assert summary["capture_to_enqueue"]["count"] == 2
+	assert summary["capture_to_control"]["count"] == 1
+	assert summary["detection_to_log"] == {"count": 0}
+
+def test_sequence_numbers():
+	recorder = TraceRecorder()
+	assert [recorder.start().seq for i in range(3)] == [0, 1, 2]
@@ -0,0 +1,60 @@
+import math
+import os
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+# the marker pose math lives with the OpencvScripts that use it
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))),
+                                "OpencvScripts"))
+
+import marker_pose
+
+
+def euler_angles(R):
+	'''
+	The per-marker rotationMatrixToEulerAngles detect_pos.py used before the
+	batched version.
+	'''
+	sy = math.sqrt(R[0, 0] * R[0, 0] + R[1, 0] * R[1, 0])
+	if sy >= 1e-6:
+		return np.array([math.atan2(R[2, 1], R[2, 2]), math.atan2(-R[2, 0], sy), math.atan2(R[1, 0], R[0, 0])])
+	return np.array([math.atan2(-R[1, 2], R[1, 1]), math.atan2(-R[2, 0], sy), 0])
+
+
+def random_rvecs(count, seed=11):
+	rng = np.random.default_rng(seed)
+	axes = rng.normal(size=(count, 3))
+	axes /= np.linalg.norm(axes, axis=1)[:, None]
+	rvecs = axes * rng.uniform(0, math.pi, (count, 1))
+	# the identity and a gimbal lock pose (90 deg about y)
+	return np.vstack((rvecs, [[0, 0, 0], [0, math.pi / 2, 0]]))
+
+
+def test_rodrigues_matches_opencv():
+	rvecs = random_rvecs(500)
+	batched = marker_pose.rodrigues(rvecs.reshape(-1, 1, 3))
+	for rvec, R in zip(rvecs, batched):
+		assert np.allclose(R, cv2.Rodrigues(rvec)[0], atol=1e-9)
+
+
+def test_poses_match_the_per_marker_code():
+	rvecs = random_rvecs(500).reshape(-1, 1, 3)
+	rng = np.random.default_rng(12)
+	tvecs = np.column_stack((rng.uniform(-50, 50, (len(rvecs), 2)), rng.uniform(20, 300, len(rvecs))))
+	R_tc, pos_camera, attitude, angle_bias = marker_pose.marker_poses(rvecs, tvecs.reshape(-1, 1, 3))
+	for i in range(len(rvecs)):
+		R_ct = cv2.Rodrigues(rvecs[i, 0])[0]
+		assert np.allclose(R_tc[i], R_ct.T, atol=1e-9)
+		assert np.allclose(pos_camera[i], -R_ct.T.dot(tvecs[i]), atol=1e-6)
+		expected = euler_angles(marker_pose.R_flip.dot(R_ct.T))
+		assert np.allclose(attitude[i], expected, atol=1e-9)
+		assert np.allclose(angle_bias[i], [math.atan2(tvecs[i, 0], tvecs[i, 2]), math.atan2(tvecs[i, 1], tvecs[i, 2])])
+
+
+def test_non_rotation_raises_value_error():
+	R = np.stack((np.eye(3), np.diag([1.0, 2.0, 1.0])))
+	with pytest.raises(ValueError):
+		marker_pose.rotation_matrix_to_euler_angles(R)
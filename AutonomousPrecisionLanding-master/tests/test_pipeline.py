@@ -0,0 +1,177 @@
+import collections
+import threading
+import time
+import types
+
+import pytest
+
+pytest.importorskip("dronekit")
+
+from frame_ring import FrameRing
+from latency_trace import TraceRecorder
+from pipeline import Mailbox, Pipeline
+from target_tracker import KalmanTracker
+import control
+import detectors
+import search_image
+
+Attitude = collections.namedtuple("Attitude", "pitch yaw roll")
+
+def test_get_takes_the_newest_value_once():
+	box = Mailbox()
+	box.put(1)
+	box.put(2)
+	assert box.get(timeout=0) == 2
+	assert box.get(timeout=0) is None
+
+def test_put_returns_the_value_it_overwrote():
+	box = Mailbox()
+	assert box.put(1) is None
+	assert box.put(2) == 1
+	box.get(timeout=0)
+	# a value that was taken is not displaced again
+	assert box.put(3) is None
+
+def test_get_waits_for_a_put():
+	box = Mailbox()
+	threading.Timer(0.05, box.put, args=("frame",)).start()
+	assert box.get(timeout=5) == "frame"
+
+def test_get_times_out():
+	box = Mailbox()
+	begin = time.monotonic()
+	assert box.get(timeout=0.05) is None
+	assert time.monotonic() - begin >= 0.04
+
+def test_close_wakes_a_waiting_get_and_returns_the_untaken_value():
+	box = Mailbox()
+	result = []
+	thread = threading.Thread(target=lambda: result.append(box.get(timeout=5)))
+	thread.start()
+	time.sleep(0.05)
+	assert box.close() is None
+	thread.join(1)
+	assert not thread.is_alive()
+	assert result == [None]
+
+	box = Mailbox()
+	box.put("left over")
+	assert box.close() == "left over"
+	assert box.get(timeout=0) is None
+
+class FoundPool(object):
+	'''
+	DetectorPool stand-in that finds the target in every frame it is given.
+	'''
+
+	def __init__(self):
+		self.submitted = []
+
+	def submit_slot(self, slot, location, attitude, window=None):
+		self.submitted.append(slot)
+		return len(self.submitted) - 1
+
+	def wait(self, seq, timeout=None):
+		now = time.monotonic()
+		return detectors.Detection(1, (5.0, 5.0), [(0, 0, 10, 10)]), (now, now)
+
+def run_stage(stage):
+	thread = threading.Thread(target=stage)
+	thread.daemon = True
+	thread.start()
+	return thread
+
+def test_skipped_frames_are_logged_but_not_sent_to_control():
+	ring = FrameRing(slots=4, shape=(150, 200, 3))
+	recorder = TraceRecorder()
+	pipeline = Pipeline(None, True, FoundPool(), ring, None, recorder, detect_every=2)
+	pipeline.running.set()
+	thread = run_stage(pipeline.detection_stage)
+	try:
+		sent = []
+		for i in range(2):
+			slot, frame = ring.acquire()
+			pipeline.frames.put({"slot": slot, "location": None, "attitude": None, "trace": recorder.start()})
+			logged = pipeline.logs.get(timeout=5)
+			assert logged["slot"] == slot
+			sent.append(pipeline.detections.get(timeout=0.2))
+			ring.release(slot)
+		assert sent[0]["detection"].found
+		# the skipped frame must not replace the real detection with an empty one
+		assert sent[1] is None
+		assert len(pipeline.detector_pool.submitted) == 1
+	finally:
+		pipeline.running.clear()
+		thread.join(1)
+		ring.close()
+
+class MovingFlow(object):
+	'''
+	FlowTracker stand-in following a box that moves 10 px right every frame.
+	'''
+
+	def __init__(self):
+		self.box = [40, 30, 20, 20]
+		self.points = [None] * 8
+
+	def needs_detection(self):
+		return False
+
+	def track(self, img):
+		self.box[0] += 10
+		return [tuple(self.box)]
+
+def test_flow_results_move_the_search_window():
+	ring = FrameRing(slots=4, shape=(150, 200, 3))
+	recorder = TraceRecorder()
+	roi_tracker = search_image.RoiTracker()
+	pipeline = Pipeline(None, True, FoundPool(), ring, None, recorder, roi_tracker=roi_tracker,
+	                    flow_tracker=MovingFlow())
+	pipeline.running.set()
+	thread = run_stage(pipeline.detection_stage)
+	try:
+		for i in range(3):
+			slot, frame = ring.acquire()
+			pipeline.frames.put({"slot": slot, "location": None, "attitude": None, "trace": recorder.start()})
+			pipeline.logs.get(timeout=5)
+			ring.release(slot)
+		assert roi_tracker.box == (70, 30, 20, 20)
+		assert pipeline.detector_pool.submitted == []
+	finally:
+		pipeline.running.clear()
+		thread.join(1)
+		ring.close()
+
+def test_control_flies_on_the_kalman_prediction_between_detections(monkeypatch):
+	commands = []
+	monkeypatch.setattr(control, "land", lambda vehicle, target, attitude, location, dt: commands.append((target, dt)))
+	vehicle = types.SimpleNamespace(attitude=Attitude(0.0, 0.0, 0.0),
+	                                location=types.SimpleNamespace(global_relative_frame=None))
+	kalman = KalmanTracker()
+	kalman.update((10.0, 0.0), time.monotonic())
+	pipeline = Pipeline(vehicle, True, None, None, None, None, kalman=kalman, control_period=0.05)
+	pipeline.running.set()
+	thread = run_stage(pipeline.control_stage)
+	time.sleep(0.5)
+	pipeline.running.clear()
+	thread.join(1)
+	# no detection arrived, control still ran at about its own rate
+	assert 5 <= len(commands) <= 11
+	assert all(target is not None for target, dt in commands)
+	assert all(0.04 <= dt < 0.2 for target, dt in commands[1:])
+
+def test_control_without_kalman_waits_for_detections(monkeypatch):
+	commands = []
+	monkeypatch.setattr(control, "land", lambda *args: commands.append(args))
+	pipeline = Pipeline(None, True, None, None, None, None, control_period=0.02)
+	pipeline.running.set()
+	thread = run_stage(pipeline.control_stage)
+	time.sleep(0.1)
+	assert commands == []
+	pipeline.detections.put({"location": None, "attitude": None, "trace": TraceRecorder().start(),
+	                         "detection": detectors.Detection(1, (1.0, 2.0))})
+	time.sleep(0.1)
+	pipeline.running.clear()
+	thread.join(1)
+	assert len(commands) == 1
+	assert commands[0][1] == (1.0, 2.0)
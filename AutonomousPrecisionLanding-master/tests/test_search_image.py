@@ -0,0 +1,188 @@
+import collections
+
+import cv2
+import numpy as np
+import pytest
+
+import detectors
+import search_image
+
+
+# only the altitude of a LocationGlobalRelative is used for the scale bounds
+Location = collections.namedtuple("Location", "alt")
+
+
+@pytest.fixture
+def scene():
+	'''
+	The simulator with the pad at home, rendering as fast as frames are asked for.
+	'''
+	pytest.importorskip("dronekit")
+	import sim
+	sim.load_target(sim.filename, sim.target_size)
+	sim.set_realtime(False)
+	sim.enable_render_cache(0)
+	yield sim
+	sim.load_background(None)
+	sim.set_realtime(True)
+
+
+def camera_frame(sim, alt, north=0.0, east=0.0, size=(200, 150)):
+	'''
+	The pad seen straight down from alt metres, north/east metres off it,
+	rendered by the simulator and shrunk to size the way video.get_frame does.
+	Returns the frame and the (width, height) of the pad in it.
+	'''
+	from dronekit import Attitude
+	sim.targetLocation.x = sim.targetLocation.y = sim.targetLocation.z = 0.0
+	sim.vehicleLocation.x = -north
+	sim.vehicleLocation.y = -east
+	sim.vehicleLocation.z = alt
+	img = sim.get_frame(Attitude(0, 0, 0))
+	if size is not None:
+		img = cv2.resize(img, size)
+	covered = np.any(img != sim.backgroundColor, axis=2)
+	rows, cols = np.nonzero(covered)
+	return img, (cols.max() - cols.min() + 1, rows.max() - rows.min() + 1)
+
+
+def test_expected_size_follows_the_frame_size():
+	full = search_image.expected_target_size(10, frame_size=(640, 480))
+	small = search_image.expected_target_size(10, frame_size=(200, 150))
+	assert abs(small / full - 200 / 640.0) < 1e-9
+
+
+def test_bounds_bracket_the_pad_in_a_small_frame(scene):
+	for alt in (3, 5, 10, 15):
+		img, (width, height) = camera_frame(scene, alt)
+		expected = search_image.expected_target_size(alt, frame_size=(img.shape[1], img.shape[0]))
+		# the prediction matches what the simulator renders, not just the tolerance band
+		assert abs(expected / ((width + height) / 2.0) - 1) < 0.1
+		smallest, largest = search_image.scale_bounds(Location(alt), frame_size=(img.shape[1], img.shape[0]))
+		assert smallest[0] < min(width, height) and max(width, height) < largest[0]
+
+
+def test_bounds_are_capped_to_the_window():
+	smallest, largest = search_image.scale_bounds(Location(2), frame_size=(200, 150), window=(0, 0, 60, 40))
+	assert largest == (40, 40)
+	assert smallest[0] <= largest[0]
+
+
+def test_cascade_finds_the_pad_in_a_small_frame(scene):
+	img, size = camera_frame(scene, 5)
+	detection = detectors.create("haar").detect(img, Location(5))
+	assert detection.found
+	x, y, w, h = detection.boxes[-1]
+	assert abs(x + w / 2.0 - 100) < 5 and abs(y + h / 2.0 - 75) < 5
+	# in reference pixels, a pad in the middle of any frame is at (0, 0)
+	assert np.hypot(*detection.center) < 10
+
+
+def test_coarse_to_fine_returns_one_box_per_target(scene):
+	cascade = detectors.create("haar").cascade
+	scene.load_background()
+	# on the ground texture two overlapping crops refine to the pad here
+	img, size = camera_frame(scene, 4.23, -0.44, 0.85, size=(640, 480))
+	full, counts = search_image.cascade_search(cascade, img)
+	boxes, neighbours = search_image.coarse_to_fine_search(cascade, img, coarse=2)
+	assert len(full) == 1
+	assert len(boxes) == 1 and len(neighbours) == 1
+	assert np.abs(np.array(boxes[0]) - full[0]).max() < 0.1 * full[0][2]
+
+
+def test_grouping_keeps_separate_targets():
+	boxes = np.array([[10, 10, 50, 50], [12, 9, 52, 52], [200, 100, 40, 40]], dtype=np.int32)
+	merged, neighbours = search_image.group_boxes(boxes, np.array([4, 9, 6], dtype=np.int32))
+	assert len(merged) == 2
+	assert sorted(neighbours.tolist()) == [6, 9]
+
+
+def pad_center(sim, img):
+	covered = np.any(img != sim.backgroundColor, axis=2)
+	rows, cols = np.nonzero(covered)
+	return np.array([(cols.min() + cols.max() + 1) / 2.0, (rows.min() + rows.max() + 1) / 2.0])
+
+
+def box_center(box):
+	x, y, w, h = box
+	return np.array([x + w / 2.0, y + h / 2.0])
+
+
+def seeded_tracker(sim, alt, **options):
+	img, size = camera_frame(sim, alt, size=(320, 240))
+	detection = detectors.create("haar").detect(img, Location(alt))
+	tracker = search_image.FlowTracker(**options)
+	assert tracker.start(img, detection.boxes)
+	return tracker, box_center(detection.boxes[-1]) - pad_center(sim, img)
+
+
+def test_flow_follows_a_small_shift(scene):
+	tracker, offset = seeded_tracker(scene, 5)
+	img, size = camera_frame(scene, 5, north=0.1, east=-0.15, size=(320, 240))
+	box = tracker.track(img)
+	assert box is not None
+	# the box keeps its place on the pad, which moved ~10 px
+	assert np.abs(box_center(box[-1]) - offset - pad_center(scene, img)).max() < 2
+	assert not tracker.needs_detection()
+
+
+def test_flow_is_lost_when_the_pad_leaves_the_frame(scene):
+	tracker, offset = seeded_tracker(scene, 5)
+	for east in np.arange(0.2, 4.0, 0.2):
+		img, size = camera_frame(scene, 5, east=east, size=(320, 240))
+		if tracker.track(img) is None:
+			break
+	else:
+		assert False, "still tracking after the pad left the frame"
+	assert tracker.needs_detection()
+	assert tracker.lost == 1
+
+
+def test_flow_asks_for_detection_after_refresh_frames(scene):
+	tracker, offset = seeded_tracker(scene, 5, refresh=4)
+	for north in (0.02, 0.04, 0.06):
+		img, size = camera_frame(scene, 5, north=north, size=(320, 240))
+		assert tracker.track(img) is not None
+		assert not tracker.needs_detection()
+	img, size = camera_frame(scene, 5, north=0.08, size=(320, 240))
+	assert tracker.track(img) is not None
+	assert tracker.needs_detection()
+	assert tracker.tracked == 4 and tracker.lost == 0
+
+
+def tag_frame(x, y, side=60, shape=(240, 320)):
+	'''
+	A white frame with AprilTag 36h11 id 0 drawn side px wide at (x, y).
+	'''
+	dictionary = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_APRILTAG_36H11)
+	img = np.full(shape + (3,), 255, dtype=np.uint8)
+	img[y:y+side, x:x+side] = cv2.aruco.generateImageMarker(dictionary, 0, side)[:,:,None]
+	return img
+
+
+@pytest.mark.parametrize("window", [None, (150, 40, 120, 110)])
+def test_apriltag_center_and_box(window):
+	img = tag_frame(180, 70)
+	ms, center, target, pose = search_image.detect_fiducial(img, window=window)
+	assert target is not None and len(target) == 1
+	# boxes are in full frame pixels whatever window was searched
+	assert np.abs(np.array(target[0]) - (180, 70, 60, 60)).max() <= 1
+	# the tag middle (210, 100) of a 320x240 frame, in reference pixels
+	expected = ((210 - 160) * 2.0, (120 - 100) * 2.0)
+	assert np.hypot(center[0] - expected[0], center[1] - expected[1]) < 2
+
+
+def test_apriltag_outside_the_window_is_not_found():
+	img = tag_frame(180, 70)
+	detection = detectors.create("apriltag").detect(img, window=(0, 0, 150, 240))
+	assert not detection.found
+	detection = detectors.create("apriltag").detect(img)
+	assert detection.found and np.hypot(detection.center[0] - 100, detection.center[1] - 40) < 2
+
+
+def test_centers_are_in_reference_pixels():
+	assert search_image.target_center((90, 65, 20, 20), (150, 200, 3)) == (0.0, 0.0)
+	x, y = search_image.target_center((0, 0, 20, 20), (150, 200, 3))
+	# 90 px left and 65 px up of the middle of a 200x150 frame
+	assert abs(x + 90 * 640 / 200.0) < 1e-9 and abs(y - 65 * 480 / 150.0) < 1e-9
+	assert search_image.target_center((0, 0, 20, 20), (480, 640, 3)) == (-310.0, 230.0)
@@ -0,0 +1,143 @@
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip("dronekit")
+
+from dronekit import LocationGlobalRelative, Attitude
+
+from latency_trace import TraceRecorder
+import sim
+
+home = LocationGlobalRelative(-35.363261, 149.165230, 0)
+
+@pytest.fixture
+def scene():
+	sim.load_target(sim.filename, sim.target_size)
+	sim.set_realtime(False)
+	sim.enable_render_cache(0)
+	sim.set_target_location(home)
+	sim.refresh_simulator(LocationGlobalRelative(home.lat, home.lon, 10), None)
+	yield
+	sim.enable_render_cache(0)
+	sim.set_realtime(True)
+
+def test_capture_is_stamped_before_rendering(scene, monkeypatch):
+	rendered = []
+	simulate_target = sim.simulate_target
+
+	def slow_render(*args, **kwargs):
+		time.sleep(0.02)
+		rendered.append(time.monotonic())
+		return simulate_target(*args, **kwargs)
+
+	monkeypatch.setattr(sim, "simulate_target", slow_render)
+	trace = TraceRecorder().start()
+	sim.get_frame(Attitude(0, 0, 0), trace=trace)
+	assert trace.capture <= rendered[0] - 0.02
+
+def render(north, east, alt, pitch=0.0, roll=0.0, yaw=0.0):
+	'''
+	Frame from alt metres above and north/east metres from the target, the
+	relative pose cached_target sees.
+	'''
+	sim.vehicleLocation.x = sim.targetLocation.x - north
+	sim.vehicleLocation.y = sim.targetLocation.y - east
+	sim.vehicleLocation.z = sim.targetLocation.z + alt
+	return sim.get_frame(Attitude(pitch, yaw, roll))
+
+def centroid(frame):
+	covered = np.any(frame != sim.backgroundColor, axis=2)
+	rows, cols = np.nonzero(covered)
+	return np.array([cols.mean(), rows.mean()])
+
+def scalar_corners(thetaX, thetaY, thetaZ, aX, aY, aZ, cX, cY, cZ):
+	'''
+	Target corners in camera pixels one project_3D_to_2D call at a time, as
+	target_transform did before it was vectorized, in double precision.
+	'''
+	half_w, half_h = sim.target_width/2.0, sim.target_height/2.0
+	corners = []
+	for x, y in ((-half_w, half_h), (half_w, half_h), (-half_w, -half_h), (half_w, -half_h)):
+		x, y = x + cX - half_w, y + cY - half_h
+		x, y = sim.project_3D_to_2D(thetaX, thetaY, thetaZ, aY, aX, aZ, y, x, cZ, sim.camera_height,
+		                            sim.camera_width, sim.camera_fov)
+		corners.append(sim.shift_to_image((x, y), sim.camera_width, sim.camera_height))
+	return np.array(corners)
+
+def test_vectorized_projection_matches_the_scalar_one(scene):
+	rng = np.random.default_rng(5)
+	ppm = sim.pixels_per_meter
+	half_w, half_h = sim.target_width/2.0, sim.target_height/2.0
+	source = np.float32([[-half_w, half_h], [half_w, half_h], [-half_w, -half_h], [half_w, -half_h]])
+	for i in range(50):
+		# absolute coordinates as get_frame passes them, ~1e9 px from the origin
+		north, east, alt = rng.uniform(-3, 3), rng.uniform(-3, 3), rng.uniform(2, 20)
+		angles = tuple(rng.uniform(-0.2, 0.2, 3))
+		aX, aY, aZ = sim.targetLocation.x * ppm, sim.targetLocation.y * ppm, sim.targetLocation.z * ppm
+		cX, cY, cZ = aX - north * ppm, aY - east * ppm, aZ + alt * ppm
+		assert abs(cX) > 1e8 or abs(cY) > 1e8
+		expected = scalar_corners(*(angles + (aX, aY, aZ, cX, cY, cZ)))
+		M = sim.target_transform(*(angles + (aX, aY, aZ, cX, cY, cZ, sim.camera_height, sim.camera_width,
+		                                     sim.camera_fov)))
+		corners = sim.cv2.perspectiveTransform(source.reshape(-1, 1, 2), M).reshape(-1, 2)
+		assert np.abs(corners - expected).max() < 0.5
+		points = [(float(y) + cY - half_h, float(x) + cX - half_w, cZ) for x, y in source]
+		projected = sim.project_points(sim.rotation_matrix(*angles), aY, aX, aZ, points, sim.camera_height,
+		                               sim.camera_width, sim.camera_fov)
+		assert np.abs(projected * (1, -1) + (sim.camera_width/2.0, sim.camera_height/2.0) - expected).max() < 0.5
+
+def test_cache_hit_is_the_render_of_the_bucket_pose(scene):
+	cache = sim.enable_render_cache()
+	pose = (0.7, -0.4, 8.0, 0.02, -0.01, 0.3)
+	first = render(*pose)
+	nearby = render(pose[0] + 0.001, pose[1], pose[2], pose[3], pose[4], pose[5])
+	assert cache.stats()["misses"] == 1 and cache.stats()["hits"] == 1
+	assert np.array_equal(first, nearby)
+	sim.enable_render_cache(0)
+	assert np.array_equal(first, render(*cache.pose(cache.key(*pose))))
+
+def test_cached_frames_stay_within_the_quantization_step(scene):
+	rng = np.random.default_rng(3)
+	for i in range(20):
+		pose = (rng.uniform(-2, 2), rng.uniform(-2, 2), rng.uniform(3, 15)) + tuple(rng.uniform(-0.1, 0.1, 3))
+		sim.enable_render_cache(0)
+		exact = render(*pose)
+		sim.enable_render_cache()
+		cached = render(*pose)
+		# half a lateral step is ~0.6 px and half an angle step ~0.5 px at 640x480
+		assert np.abs(centroid(cached) - centroid(exact)).max() < 2.0
+		assert np.mean(np.abs(cached.astype(int) - exact.astype(int))) < 3.0
+
+def test_cache_is_not_used_near_the_ground(scene):
+	cache = sim.enable_render_cache()
+	render(0.1, 0.1, sim.min_cached_alt / 2)
+	assert cache.stats()["hits"] + cache.stats()["misses"] == 0
+
+def test_least_recently_used_frames_are_evicted():
+	frame = np.zeros((10, 10, 3), dtype=np.uint8)
+	cache = sim.RenderCache(max_bytes=3 * frame.nbytes)
+	for key in range(3):
+		cache.put(key, frame.copy())
+	assert cache.get(0) is not None
+	cache.put(3, frame.copy())
+	# 1 was the least recently used once 0 was read
+	assert cache.get(1) is None
+	assert all(cache.get(key) is not None for key in (0, 2, 3))
+	stats = cache.stats()
+	assert stats["evictions"] == 1
+	assert stats["frames"] == 3 and stats["bytes"] == 3 * frame.nbytes
+	assert stats["hits"] == 4 and stats["misses"] == 1
+
+def test_frames_larger_than_the_budget_are_not_kept():
+	cache = sim.RenderCache(max_bytes=10)
+	cache.put(0, np.zeros((10, 10, 3), dtype=np.uint8))
+	assert cache.stats()["frames"] == 0
+
+def test_loading_a_target_clears_the_cache(scene):
+	cache = sim.enable_render_cache()
+	render(0.5, 0.5, 8.0)
+	assert cache.stats()["frames"] == 1
+	sim.load_target(sim.filename, sim.target_size)
+	assert cache.stats()["frames"] == 0 and cache.bytes == 0
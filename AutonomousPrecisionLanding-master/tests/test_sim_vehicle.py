@@ -0,0 +1,133 @@
+import math
+import time
+
+import pytest
+
+pytest.importorskip("dronekit")
+
+from dronekit import VehicleMode
+from flight_assist import SetpointStreamer, send_ned_velocity, send_velocity, setpoint_streamers, \
+	start_setpoint_streamer, stop_setpoint_streamer
+from sim_vehicle import SimVehicle
+
+
+@pytest.fixture
+def vehicle():
+	'''
+	Armed in GUIDED on the ground, setpoints go through a streamer ticked on
+	simulated time like the offline loop does.
+	'''
+	vehicle = SimVehicle()
+	vehicle.mode = VehicleMode("GUIDED")
+	vehicle.armed = True
+	start_setpoint_streamer(vehicle, clock=vehicle.clock, threaded=False)
+	yield vehicle
+	stop_setpoint_streamer(vehicle)
+
+
+def fly(vehicle, seconds, dt=0.1):
+	streamer = setpoint_streamers[vehicle]
+	for i in range(int(round(seconds / dt))):
+		streamer.tick()
+		vehicle.step(dt)
+
+
+def test_takeoff_climbs_to_the_target_altitude(vehicle):
+	vehicle.simple_takeoff(10)
+	assert vehicle.run_until(lambda: vehicle.location.global_relative_frame.alt >= 9.5, timeout=30)
+	fly(vehicle, 10)
+	assert abs(vehicle.location.global_relative_frame.alt - 10) < 0.2
+
+
+def test_velocity_follows_the_setpoint_with_a_lag(vehicle):
+	vehicle.position[2] = 10.0
+	send_ned_velocity(vehicle, 1.0, 0, 0, 20)
+	fly(vehicle, vehicle.time_constant)
+	# a first order lag reaches 1 - 1/e after one time constant
+	assert 0.5 < vehicle.velocity[0] < 0.8
+	fly(vehicle, 5 * vehicle.time_constant)
+	assert abs(vehicle.velocity[0] - 1.0) < 0.02
+	# accelerating north pitches the nose down
+	assert vehicle.attitude.pitch <= 0
+
+
+def test_acceleration_is_limited(vehicle):
+	vehicle.position[2] = 10.0
+	send_ned_velocity(vehicle, 20.0, 0, 0, 20)
+	fly(vehicle, 0.1)
+	assert abs(vehicle.velocity[0] - vehicle.max_accel * 0.1) < 1e-9
+
+
+def test_setpoint_is_dropped_after_the_timeout(vehicle):
+	vehicle.position[2] = 10.0
+	send_ned_velocity(vehicle, 1.0, 0, 0, 20)
+	# sent once, then nothing refreshes it
+	setpoint_streamers[vehicle].tick()
+	vehicle.run_until(lambda: False, timeout=vehicle.setpoint_timeout - 0.5)
+	assert vehicle.commanded_velocity() == (1.0, 0, 0)
+	vehicle.run_until(lambda: False, timeout=1.0)
+	assert vehicle.commanded_velocity() == (0.0, 0.0, 0.0)
+
+
+def test_body_frame_velocity_is_rotated_by_yaw(vehicle):
+	vehicle.position[2] = 10.0
+	vehicle.yaw = vehicle.target_yaw = math.radians(90)
+	# forward while facing east
+	send_velocity(vehicle, 1.0, 0, 0, 20)
+	fly(vehicle, 0.1)
+	north, east, up = vehicle.commanded_velocity()
+	assert abs(north) < 1e-9 and abs(east - 1.0) < 1e-9
+
+
+def test_land_descends_and_disarms(vehicle):
+	vehicle.position[2] = 3.0
+	vehicle.mode = VehicleMode("LAND")
+	assert vehicle.run_until(lambda: not vehicle.armed, timeout=30)
+	assert vehicle.location.global_relative_frame.alt == 0.0
+	# descending at land_speed takes about alt / land_speed
+	assert 3.0 / vehicle.land_speed - 1 < vehicle.clock() < 3.0 / vehicle.land_speed + 2
+
+
+class Recorder(object):
+
+	def __init__(self):
+		self.sent = []
+
+	def send_mavlink(self, msg):
+		self.sent.append(msg)
+
+
+def test_streamer_resends_until_the_duration_expires():
+	now = [0.0]
+	vehicle = Recorder()
+	streamer = SetpointStreamer(vehicle, clock=lambda: now[0])
+	streamer.set("velocity", 1.0)
+	for i in range(15):
+		streamer.tick()
+		now[0] += 0.1
+	# sent at 0.0 .. 1.0, then dropped
+	assert vehicle.sent == ["velocity"] * 11
+	assert streamer.msg is None
+
+
+def test_streamer_replaces_the_stale_setpoint():
+	now = [0.0]
+	vehicle = Recorder()
+	streamer = SetpointStreamer(vehicle, clock=lambda: now[0])
+	streamer.set("first", 5.0)
+	streamer.tick()
+	now[0] += 0.1
+	streamer.set("second", 5.0)
+	streamer.tick()
+	assert vehicle.sent == ["first", "second"]
+
+
+def test_streamer_ignores_wall_clock_steps(monkeypatch):
+	vehicle = Recorder()
+	streamer = SetpointStreamer(vehicle)
+	streamer.set("velocity", 1.0)
+	# the wall clock jumps an hour ahead, as after an NTP correction
+	wall = time.time()
+	monkeypatch.setattr(time, "time", lambda: wall + 3600)
+	streamer.tick()
+	assert vehicle.sent == ["velocity"]
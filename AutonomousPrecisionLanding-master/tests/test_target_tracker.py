@@ -0,0 +1,50 @@
+from target_tracker import KalmanTracker
+
+
+def tracked(positions, period=0.1):
+	'''
+	A tracker fed one detection per period at the given centers.
+	'''
+	tracker = KalmanTracker()
+	for i, center in enumerate(positions):
+		tracker.predict(i * period)
+		assert tracker.update(center, i * period)
+	return tracker, len(positions) * period
+
+
+def test_consistent_detections_are_used():
+	tracker, now = tracked([(0.0, 0.0), (5.0, 0.0), (10.0, 0.0), (15.0, 0.0)])
+	assert tracker.updates == 4
+	x, y = tracker.predict(now)
+	assert abs(x - 20.0) < 3.0 and abs(y) < 3.0
+
+
+def test_outlier_is_gated_out_and_leaves_the_track_alone():
+	tracker, now = tracked([(0.0, 0.0)] * 5)
+	tracker.predict(now)
+	before = tracker.x.copy()
+	assert not tracker.update((150.0, -120.0), now)
+	assert tracker.rejected == 1
+	assert (tracker.x == before).all()
+	# a detection near the track is still accepted and clears the reject count
+	assert tracker.update((1.0, 0.0), now)
+	assert tracker.rejects == 0
+
+
+def test_track_restarts_after_repeated_rejections():
+	tracker, now = tracked([(0.0, 0.0)] * 5)
+	for i in range(tracker.max_rejects):
+		tracker.predict(now)
+		assert not tracker.update((200.0, 200.0), now)
+	assert not tracker.active
+	# the next detection starts a new track where the target now is
+	tracker.predict(now)
+	assert tracker.update((200.0, 200.0), now)
+	assert tracker.estimate(now) == (200.0, 200.0)
+
+
+def test_estimate_expires_after_coasting():
+	tracker, now = tracked([(0.0, 0.0)] * 3)
+	last = now - 0.1
+	assert tracker.estimate(last + tracker.max_coast - 0.01) is not None
+	assert tracker.estimate(last + tracker.max_coast + 0.01) is None
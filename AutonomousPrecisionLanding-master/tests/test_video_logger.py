@@ -0,0 +1,108 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from video_logger import VideoLogger
+
+class Writer(object):
+	'''
+	Stands in for cv2.VideoWriter; write() blocks while gate is clear.
+	'''
+
+	def __init__(self):
+		self.gate = threading.Event()
+		self.gate.set()
+		self.frames = []
+		self.released = False
+
+	def write(self, frame):
+		self.gate.wait()
+		self.frames.append(frame)
+
+	def release(self):
+		self.released = True
+
+def frame(value=0):
+	return np.full((4, 4, 3), value, dtype=np.uint8)
+
+def wait_for(condition, timeout=5.0):
+	end = time.monotonic() + timeout
+	while not condition():
+		assert time.monotonic() < end
+		time.sleep(0.001)
+
+def stall(writer, logger):
+	'''
+	Block the writer on one frame so everything after it queues up.
+	'''
+	writer.gate.clear()
+	logger.write(frame(), None)
+	wait_for(lambda: len(logger.frames) == 0)
+
+@pytest.mark.parametrize("policy", ["drop_oldest", "decimate"])
+def test_every_frame_is_written_while_the_writer_keeps_up(policy):
+	writer = Writer()
+	logger = VideoLogger(writer, max_queue=4, policy=policy, decimate=2)
+	for i in range(20):
+		logger.write(frame(i), None)
+		wait_for(lambda: logger.written == i + 1)
+	logger.close()
+	assert logger.written == 20
+	assert logger.decimated == 0
+	assert logger.dropped == 0
+	assert [int(f[0, 0, 0]) for f in writer.frames] == list(range(20))
+	assert writer.released
+
+def test_drop_oldest_keeps_the_newest_frames():
+	writer = Writer()
+	logger = VideoLogger(writer, max_queue=8, policy="drop_oldest")
+	stall(writer, logger)
+	for i in range(1, 21):
+		logger.write(frame(i), None)
+	assert len(logger.frames) == 8
+	assert logger.dropped == 12
+	assert logger.decimated == 0
+	writer.gate.set()
+	logger.close()
+	assert [int(f[0, 0, 0]) for f in writer.frames] == [0] + list(range(13, 21))
+
+def test_decimate_starts_above_the_high_water_mark():
+	writer = Writer()
+	logger = VideoLogger(writer, max_queue=8, policy="decimate", decimate=2, high_water=4)
+	stall(writer, logger)
+	for i in range(1, 5):
+		logger.write(frame(i), None)
+	# below the mark nothing is thinned out
+	assert logger.decimated == 0
+	assert len(logger.frames) == 4
+
+	for i in range(5, 13):
+		logger.write(frame(i), None)
+	# every other frame from then on, until the queue is full
+	assert logger.decimated == 4
+	assert logger.dropped == 0
+	assert len(logger.frames) == 8
+
+	for i in range(13, 21):
+		logger.write(frame(i), None)
+	assert logger.decimated == 8
+	assert logger.dropped == 4
+	assert len(logger.frames) == logger.frames.maxlen
+
+	writer.gate.set()
+	logger.close()
+	assert logger.written == 9
+	assert logger.submitted == 21
+
+def test_raw_stream_gets_the_frames_without_highlights():
+	writer = Writer()
+	raw = Writer()
+	logger = VideoLogger(writer, raw_vid=raw)
+	logger.write(frame(), np.array([[0, 0, 3, 3]]))
+	logger.close()
+	assert raw.released and writer.released
+	assert not raw.frames[0].any()
+	# the highlighted copy has the box drawn in, the raw frame is untouched
+	assert writer.frames[0].any()
@@ -14,6 +14,8 @@ import numpy as np
 import multiprocessing
 
 cores_available = multiprocessing.cpu_count()
+frame_width = 200
+frame_height = 150
 
 
 def image_capture_background(imgcap_connection):
@@ -56,19 +58,26 @@ def startCamera():
 
     print("Camera is opened")'''
 
-def get_frame():
+def get_frame(out=None, trace=None):
+    '''
+    Grab a frame resized to frame_width x frame_height. If out is given (e.g. a
+    FrameRing slot) the frame is resized straight into it. trace, a
+    latency_trace.FrameTrace, is stamped with the capture time before the grab.
+    '''
     global cap, is_backgroundCap, parent_conn, img_counter
     img_counter =1
+    if trace is not None:
+        trace.mark("capture")
     if(is_backgroundCap):
         if(parent_conn == None):
             return None
         parent_conn.send(img_counter)
         img_counter = img_counter + 1
         img = parent_conn.recv()
-        img = cv2.resize(img, (200,150))
+        img = cv2.resize(img, (frame_width,frame_height), dst=out)
     else:
         success_flag, img= cap.read()
-        img = cv2.resize(img, (200,150))
+        img = cv2.resize(img, (frame_width,frame_height), dst=out)
 
     return img
 
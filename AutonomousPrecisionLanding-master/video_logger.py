@@ -0,0 +1,98 @@
+'''
+
+	Synopsis: Video logging thread. Target highlighting and XVID encoding run off the
+	landing loop behind a bounded queue that drops frames instead of blocking.
+
+'''
+
+#Python Imports
+import threading
+import collections
+
+#Common Library Imports
+import search_image
+
+class VideoLogger(object):
+	'''
+	policy is "drop_oldest" (a full queue discards its oldest frame) or
+	"decimate" (once high_water frames are waiting, only every decimate-th
+	frame is queued until the writer catches up, then drop_oldest). While
+	the writer keeps up every frame is logged with either policy.
+
+	raw_vid, if given, gets the same frames without the highlights, for
+	replay.py to rerun detection on.
+	'''
+
+	def __init__(self, vid, max_queue=8, policy="drop_oldest", decimate=2, high_water=None, raw_vid=None):
+		if policy not in ("drop_oldest", "decimate"):
+			raise ValueError("Unknown video log policy: " + str(policy))
+		self.vid = vid
+		self.raw_vid = raw_vid
+		self.policy = policy
+		self.decimate = max(1, int(decimate))
+		self.frames = collections.deque(maxlen=max_queue)
+		self.high_water = max(1, max_queue // 2) if high_water is None else high_water
+		self.behind = 0
+		self.cond = threading.Condition()
+		self.running = True
+		self.latest = None
+		self.submitted = 0
+		self.decimated = 0
+		self.dropped = 0
+		self.written = 0
+		self.thread = threading.Thread(name="video_logger", target=self.run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def write(self, frame, target, trace=None):
+		'''
+		Queue frame for highlighting and encoding. The logger keeps a reference
+		to frame, so it must not be overwritten afterwards. trace, if given, is
+		stamped with log_write once the frame is encoded.
+		'''
+		with self.cond:
+			self.submitted += 1
+			if self.policy == "decimate" and len(self.frames) >= self.high_water:
+				self.behind += 1
+				if self.behind % self.decimate != 0:
+					self.decimated += 1
+					return
+			else:
+				self.behind = 0
+			if len(self.frames) == self.frames.maxlen:
+				self.dropped += 1
+			self.frames.append((frame, target, trace))
+			self.cond.notify()
+
+	def run(self):
+		while True:
+			with self.cond:
+				while self.running and not self.frames:
+					self.cond.wait()
+				if not self.frames:
+					break
+				frame, target, trace = self.frames.popleft()
+			if self.raw_vid is not None:
+				self.raw_vid.write(frame)
+			rend_Image = search_image.add_target_highlights(frame, target)
+			self.vid.write(rend_Image)
+			if trace is not None:
+				trace.mark("log_write")
+			self.latest = rend_Image
+			self.written += 1
+
+	def stats(self):
+		return "Video log: %d submitted, %d written, %d dropped, %d decimated" % (
+			self.submitted, self.written, self.dropped, self.decimated)
+
+	def close(self):
+		'''
+		Write out the queued frames and release the writer.
+		'''
+		with self.cond:
+			self.running = False
+			self.cond.notify()
+		self.thread.join()
+		self.vid.release()
+		if self.raw_vid is not None:
+			self.raw_vid.release()
@@ -1,8 +1,12 @@
 import cv2
 import numpy as np
 import glob
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
+import os, sys
+import argparse
+import multiprocessing
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'AutonomousPrecisionLanding-master'))
+import calibration_store
 
 
 # 找棋盘格角点
@@ -16,41 +20,106 @@ objp = np.zeros((w*h,3), np.float32)
 objp[:,:2] = np.mgrid[0:w,0:h].T.reshape(-1,2)
 objp = objp*17.0  # 18.1 mm
 
-# 储存棋盘格角点的世界坐标和图像坐标对
-objpoints = [] # 在世界坐标系中的三维点
-imgpoints = [] # 在图像平面的二维点
-
-images = glob.glob('chessboard/*.jpg')  #   拍摄的十几张棋盘图片所在目录
+max_side = 1000 #- corners are searched on images shrunk to this many pixels on the long side
 
-i = 1
-for fname in images:
-    
+def find_corners(fname):
+    #-- pass 1: findChessboardCorners on a downscaled copy
+    #-- pass 2: cornerSubPix at full resolution, only for images with a board
+    #-- returns (fname, image size, corners or None)
     img = cv2.imread(fname)
     gray = cv2.cvtColor(img,cv2.COLOR_BGR2GRAY)
+    size = gray.shape[::-1]
+    scale = min(1.0, max_side / float(max(size)))
+    small = gray
+    if scale < 1.0:
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
     # 找到棋盘格角点
-    ret, corners = cv2.findChessboardCorners(gray, (w,h),None)
-    # 如果找到足够点对，将其存储起来
-    if ret == True:
-        print("i:", i)
-        i = i+1
-        
-        cv2.cornerSubPix(gray,corners,(11,11),(-1,-1),criteria)
-        objpoints.append(objp)
-        imgpoints.append(corners)
-        # 将角点在图像上显示
-        cv2.drawChessboardCorners(img, (w,h), corners, ret)
-        cv2.namedWindow('findCorners', cv2.WINDOW_NORMAL)
-        cv2.resizeWindow('findCorners', 810, 405)
-        cv2.imshow('findCorners',img)
-        cv2.waitKey(1)
-cv2.destroyAllWindows()
-#%% 标定
-ret, mtx, dist, rvecs, tvecs = \
-    cv2.calibrateCamera(objpoints, imgpoints, gray.shape[::-1], None, None)
-
-
-print("ret:",ret  )
-print("mtx:\n",mtx)      # 内参数矩阵
-print("dist:\n",dist   )   # 畸变系数   distortion cofficients = (k_1,k_2,p_1,p_2,k_3)
-print("rvecs:\n",rvecs)   # 旋转向量  # 外参数
-print("tvecs:\n",tvecs  )  # 平移向量  # 外参数
+    ret, corners = cv2.findChessboardCorners(small, (w,h),
+                                             cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE + cv2.CALIB_CB_FAST_CHECK)
+    if not ret:
+        return fname, size, None
+    #-- back to full resolution pixel coordinates
+    corners = (corners + 0.5) / scale - 0.5
+    cv2.cornerSubPix(gray,corners,(11,11),(-1,-1),criteria)
+    return fname, size, corners
+
+def calibrate(imgpoints, size):
+    objpoints = [objp] * len(imgpoints)
+    ret, mtx, dist, rvecs, tvecs = \
+        cv2.calibrateCamera(objpoints, imgpoints, size, None, None)
+    #-- RMS reprojection error of every image
+    errors = []
+    for corners, rvec, tvec in zip(imgpoints, rvecs, tvecs):
+        projected, _ = cv2.projectPoints(objp, rvec, tvec, mtx, dist)
+        residual = projected.reshape(-1, 2) - corners.reshape(-1, 2)
+        errors.append(np.sqrt(np.mean(np.sum(residual**2, axis=1))))
+    return ret, mtx, dist, np.array(errors)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Calibrate the camera from chessboard pictures and save the result for the other scripts and the flight code.')
+    parser.add_argument(
+        '--images', default='chessboard/*.jpg', help="Glob of the chessboard pictures.")
+    parser.add_argument(
+        '--jobs', type=int, default=None, help="Worker processes for the corner search, defaults to one per core.")
+    parser.add_argument(
+        '--cull', type=float, default=2.0, help="Drop images whose reprojection error is above this many times the median and calibrate again. 0 keeps every image.")
+    parser.add_argument(
+        '--show', action='store_true', help="Show the corners found on every image.")
+    parser.add_argument(
+        '--no-save', action='store_true', help="Only print the result.")
+    args = parser.parse_args()
+
+    images = sorted(glob.glob(args.images))  #   拍摄的十几张棋盘图片所在目录
+    pool = multiprocessing.Pool(args.jobs)
+    try:
+        found = pool.map(find_corners, images)
+    finally:
+        pool.close()
+        pool.join()
+
+    # 储存棋盘格角点的图像坐标
+    names = [fname for fname, size, corners in found if corners is not None]
+    imgpoints = [corners for fname, size, corners in found if corners is not None]
+    sizes = set(size for fname, size, corners in found)
+    print("Board found in %d of %d images" % (len(names), len(images)))
+    if len(sizes) > 1:
+        sys.exit("Images have different sizes: %s" % sorted(sizes))
+    if len(names) < 3:
+        sys.exit("Not enough images with a board to calibrate")
+    size = sizes.pop()
+
+    if args.show:
+        for fname, corners in zip(names, imgpoints):
+            # 将角点在图像上显示
+            img = cv2.imread(fname)
+            cv2.drawChessboardCorners(img, (w,h), corners, True)
+            cv2.namedWindow('findCorners', cv2.WINDOW_NORMAL)
+            cv2.resizeWindow('findCorners', 810, 405)
+            cv2.imshow('findCorners',img)
+            cv2.waitKey(500)
+        cv2.destroyAllWindows()
+
+    #%% 标定
+    ret, mtx, dist, errors = calibrate(imgpoints, size)
+    print("ret:",ret  )
+    for fname, error in zip(names, errors):
+        print("%8.3f px  %s" % (error, fname))
+
+    if args.cull > 0:
+        keep = errors <= args.cull * np.median(errors)
+        if not keep.all() and keep.sum() >= 3:
+            for fname in np.array(names)[~keep]:
+                print("culled:", fname)
+            names = [fname for fname, k in zip(names, keep) if k]
+            imgpoints = [corners for corners, k in zip(imgpoints, keep) if k]
+            ret, mtx, dist, errors = calibrate(imgpoints, size)
+            print("ret after culling:",ret  )
+
+    print("mtx:\n",mtx)      # 内参数矩阵
+    print("dist:\n",dist   )   # 畸变系数   distortion cofficients = (k_1,k_2,p_1,p_2,k_3)
+
+    #%% 保存, the other scripts and the flight code load it from here
+    if not args.no_save:
+        calibration_store.save(mtx, dist, size, ret)
+        print("saved:", calibration_store.calibration_file)
@@ -1,18 +1,13 @@
 # encoding: utf-8
+import os, sys
 import numpy as np
 import time
 import cv2  
 import cv2.aruco as aruco  
 
-mtx = np.array([
-        [964.65,       0, 527.526],
-        [      0, 962.454, 358.1611],
-        [      0,       0,       1],
-        ])
-
-
-
-dist = np.array( [-1.25332777e-01, 1.07327000e+00, -1.52290760e-03, 1.76339938e-03, -2.57610603e+00] )
+#--- Calibration written by calibration.py, shared with the flight code
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'AutonomousPrecisionLanding-master'))
+import calibration_store
 
 
 
@@ -24,6 +19,7 @@ font = cv2.FONT_HERSHEY_SIMPLEX #font for displaying
 #num = 0
 while True:  
     ret, frame = cap.read()  
+    mtx, dist = calibration_store.intrinsics((frame.shape[1], frame.shape[0]))
     # operations on the frame come here  
     
     gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)  
@@ -1,66 +1,20 @@
 import numpy as np
 import cv2
 import cv2.aruco as aruco
-import sys, time, math
+import os, sys, time, math
+
+from marker_pose import marker_poses
 
 #--- Define Tag
 marker_size  = 13.6 #- [cm]
 
 
-#------------------------------------------------------------------------------
-#------- ROTATIONS https://www.learnopencv.com/rotation-matrix-to-euler-angles/
-#------------------------------------------------------------------------------
-# Checks if a matrix is a valid rotation matrix.
-def isRotationMatrix(R):
-    Rt = np.transpose(R)
-    shouldBeIdentity = np.dot(Rt, R)
-    I = np.identity(3, dtype=R.dtype)
-    n = np.linalg.norm(I - shouldBeIdentity)
-    return n < 1e-6
-
-# Calculates rotation matrix to euler angles
-# The result is the same as MATLAB except the order
-# of the euler angles ( x and z are swapped ).
-def rotationMatrixToEulerAngles(R):
-    assert (isRotationMatrix(R))
-
-    sy = math.sqrt(R[0, 0] * R[0, 0] + R[1, 0] * R[1, 0])
-
-    singular = sy < 1e-6
-
-    if not singular:
-        x = math.atan2(R[2, 1], R[2, 2])
-        y = math.atan2(-R[2, 0], sy)
-        z = math.atan2(R[1, 0], R[0, 0])
-    else:
-        x = math.atan2(-R[1, 2], R[1, 1])
-        y = math.atan2(-R[2, 0], sy)
-        z = 0
-
-    return np.array([x, y, z])
-mtx = np.array([
-                [964.65,       0, 527.526],
-                [      0, 962.454, 358.1611],
-                [      0,       0,       1],
-                ])
+#--- Calibration written by calibration.py, shared with the flight code
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'AutonomousPrecisionLanding-master'))
+import calibration_store
 
 
 
-dist = np.array( [-1.25332777e-01, 1.07327000e+00, -1.52290760e-03, 1.76339938e-03, -2.57610603e+00] )
-
-
-
-#--- Get the camera calibration path
-'''calib_path  = ""
-camera_matrix   = np.loadtxt(calib_path+'cameraMatrix_webcam.txt', delimiter=',')
-camera_distortion   = np.loadtxt(calib_path+'cameraDistortion_webcam.txt', delimiter=',')
-'''
-#--- 180 deg rotation matrix around the x axis
-R_flip  = np.zeros((3,3), dtype=np.float32)
-R_flip[0,0] = 1.0
-R_flip[1,1] =-1.0
-R_flip[2,2] =-1.0
-
 #--- Define the aruco dictionary
 aruco_dict  = aruco.getPredefinedDictionary(aruco.DICT_APRILTAG_36H11)
 parameters  = aruco.DetectorParameters_create()
@@ -77,6 +31,7 @@ while True:
 
     #-- Read the camera frame
     ret, frame = cap.read()
+    mtx, dist = calibration_store.intrinsics((frame.shape[1], frame.shape[0]))
 
     #-- Convert in gray scale
     gray    = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) #-- remember, OpenCV stores color images in Blue, Green, Red
@@ -92,45 +47,39 @@ while True:
         #-- tvec = [[tvec_1], [tvec_2], ...]    position of the marker in camera frame
         ret = aruco.estimatePoseSingleMarkers(corners, marker_size, mtx, dist)
 
-        #-- Unpack the output, get only the first
-        rvec, tvec = ret[0][0,0,:], ret[1][0,0,:]
+        #-- Pose of the camera respect to every marker at once
+        rvecs, tvecs = ret[0], ret[1]
+        R_tc, pos_camera, attitude, angle_bias = marker_poses(rvecs, tvecs)
 
-        #-- Draw the detected marker and put a reference frame over it
+        #-- Draw the detected markers and put a reference frame over each
         aruco.drawDetectedMarkers(frame, corners, ids)
-        aruco.drawAxis(frame, mtx, dist, rvec, tvec, 10)
-
-        #-- Print the tag position in camera frame
-        str_position = "MARKER Position x=%4.0f  y=%4.0f  z=%4.0f"%(tvec[0], tvec[1], tvec[2])
-        cv2.putText(frame, str_position, (0, 100), font, 1, (0, 255, 0), 2, cv2.LINE_AA)
-
-        #-- Obtain the rotation matrix tag->camera
-        R_ct    = np.matrix(cv2.Rodrigues(rvec)[0])
-        R_tc    = R_ct.T
+        for i in range(len(ids)):
+            aruco.drawAxis(frame, mtx, dist, rvecs[i,0,:], tvecs[i,0,:], 10)
 
-        #-- Get the attitude in terms of euler 321 (Needs to be flipped first)
-        roll_marker, pitch_marker, yaw_marker = rotationMatrixToEulerAngles(R_flip*R_tc)
+        #-- One block of text per marker
+        for i in range(len(ids)):
+            tvec = tvecs[i,0,:]
+            line = 100 + 250*i
 
-        #-- Print the marker's attitude respect to camera frame
-        str_attitude = "MARKER Attitude r=%4.0f  p=%4.0f  y=%4.0f"%(math.degrees(roll_marker),math.degrees(pitch_marker),
-                            math.degrees(yaw_marker))
-        cv2.putText(frame, str_attitude, (0, 150), font, 1, (0, 255, 0), 2, cv2.LINE_AA)
+            #-- Print the tag position in camera frame
+            str_position = "MARKER %d Position x=%4.0f  y=%4.0f  z=%4.0f"%(ids[i,0], tvec[0], tvec[1], tvec[2])
+            cv2.putText(frame, str_position, (0, line), font, 1, (0, 255, 0), 2, cv2.LINE_AA)
 
+            #-- Print the marker's attitude respect to camera frame
+            roll_marker, pitch_marker, yaw_marker = np.degrees(attitude[i])
+            str_attitude = "MARKER Attitude r=%4.0f  p=%4.0f  y=%4.0f"%(roll_marker, pitch_marker, yaw_marker)
+            cv2.putText(frame, str_attitude, (0, line + 50), font, 1, (0, 255, 0), 2, cv2.LINE_AA)
 
-        #-- Now get Position and attitude f the camera respect to the marker
-        pos_camera = -R_tc*np.matrix(tvec).T
+            #-- Position and attitude of the camera respect to the marker
+            str_position = "CAMERA Position x=%4.0f  y=%4.0f  z=%4.0f"%(pos_camera[i,0], pos_camera[i,1], pos_camera[i,2])
+            cv2.putText(frame, str_position, (0, line + 100), font, 1, (0, 255, 0), 2, cv2.LINE_AA)
 
-        str_position = "CAMERA Position x=%4.0f  y=%4.0f  z=%4.0f"%(pos_camera[0], pos_camera[1], pos_camera[2])
-        cv2.putText(frame, str_position, (0, 200), font, 1, (0, 255, 0), 2, cv2.LINE_AA)
+            roll_camera, pitch_camera, yaw_camera = np.degrees(attitude[i])
+            str_attitude = "CAMERA Attitude r=%4.0f  p=%4.0f  y=%4.0f"%(roll_camera, pitch_camera, yaw_camera)
+            cv2.putText(frame, str_attitude, (0, line + 150), font, 1, (0, 255, 0), 2, cv2.LINE_AA)
 
-        #-- Get the attitude of the camera respect to the frame
-        roll_camera, pitch_camera, yaw_camera = rotationMatrixToEulerAngles(R_flip*R_tc)
-        str_attitude = "CAMERA Attitude r=%4.0f  p=%4.0f  y=%4.0f"%(math.degrees(roll_camera),math.degrees(pitch_camera),
-                            math.degrees(yaw_camera))
-        cv2.putText(frame, str_attitude, (0, 250), font, 1, (0, 255, 0), 2, cv2.LINE_AA)
-        angle_x = math.atan2(tvec[0], tvec[2])
-        angle_y = math.atan2(tvec[1], tvec[2])
-        str_angleBias = "Target AngleBias angleX=%f angleY=%f"%(angle_x, angle_y) 
-        cv2.putText(frame, str_angleBias, (0, 300), font, 1, (0, 255, 0), 2, cv2.LINE_AA)
+            str_angleBias = "Target AngleBias angleX=%f angleY=%f"%(angle_bias[i,0], angle_bias[i,1])
+            cv2.putText(frame, str_angleBias, (0, line + 200), font, 1, (0, 255, 0), 2, cv2.LINE_AA)
 
 
     #--- Display the frame
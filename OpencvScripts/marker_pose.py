@@ -0,0 +1,58 @@
+import numpy as np
+
+#------------------------------------------------------------------------------
+#------- Marker pose math for detect_pos.py, batched over markers. Every
+#------- function takes all markers at once: rvecs/tvecs as returned by
+#------- aruco.estimatePoseSingleMarkers, shape (N,1,3) or (N,3).
+#------- ROTATIONS https://www.learnopencv.com/rotation-matrix-to-euler-angles/
+#------------------------------------------------------------------------------
+
+#--- 180 deg rotation matrix around the x axis
+R_flip = np.diag([1.0, -1.0, -1.0])
+
+def rodrigues(rvecs):
+    #-- (N,3) rotation vectors -> (N,3,3) rotation matrices, same as cv2.Rodrigues on each
+    rvecs = np.asarray(rvecs, dtype=np.float64).reshape(-1, 3)
+    theta = np.linalg.norm(rvecs, axis=1)
+    small = theta < 1e-12
+    k = rvecs / np.where(small, 1.0, theta)[:, None]
+    K = np.zeros((len(rvecs), 3, 3))
+    K[:, 0, 1], K[:, 0, 2] = -k[:, 2], k[:, 1]
+    K[:, 1, 0], K[:, 1, 2] = k[:, 2], -k[:, 0]
+    K[:, 2, 0], K[:, 2, 1] = -k[:, 1], k[:, 0]
+    s = np.sin(theta)[:, None, None]
+    c = (1 - np.cos(theta))[:, None, None]
+    return np.eye(3) + s * K + c * np.matmul(K, K)
+
+def is_rotation_matrix(R, tolerance=1e-6):
+    #-- one bool per matrix
+    I = np.eye(3)
+    return np.linalg.norm(I - np.matmul(np.swapaxes(R, -1, -2), R), axis=(-2, -1)) < tolerance
+
+def rotation_matrix_to_euler_angles(R):
+    #-- (N,3,3) -> (N,3) x, y, z angles, the same convention as rotationMatrixToEulerAngles
+    #-- in detect_pos.py; near gimbal lock (sy ~ 0) z is set to 0
+    #-- raises ValueError when a matrix is not a rotation, which python -O would not catch with an assert
+    valid = is_rotation_matrix(R)
+    if not valid.all():
+        raise ValueError("Not a rotation matrix: marker(s) %s" % np.flatnonzero(~valid).tolist())
+    sy = np.hypot(R[:, 0, 0], R[:, 1, 0])
+    singular = sy < 1e-6
+    x = np.where(singular, np.arctan2(-R[:, 1, 2], R[:, 1, 1]), np.arctan2(R[:, 2, 1], R[:, 2, 2]))
+    y = np.arctan2(-R[:, 2, 0], sy)
+    z = np.where(singular, 0.0, np.arctan2(R[:, 1, 0], R[:, 0, 0]))
+    return np.stack((x, y, z), axis=1)
+
+def marker_poses(rvecs, tvecs):
+    #-- Returns, one row per marker:
+    #--   R_tc        (N,3,3) rotation camera -> tag
+    #--   pos_camera  (N,3)   camera position in the tag frame
+    #--   attitude    (N,3)   roll, pitch, yaw (euler 321, flipped) of the camera respect to the tag
+    #--   angle_bias  (N,2)   angle of the tag off the optical axis in x and y
+    tvecs = np.asarray(tvecs, dtype=np.float64).reshape(-1, 3)
+    R_ct = rodrigues(rvecs)
+    R_tc = np.swapaxes(R_ct, 1, 2)
+    pos_camera = -np.einsum('nij,nj->ni', R_tc, tvecs)
+    attitude = rotation_matrix_to_euler_angles(np.matmul(R_flip, R_tc))
+    angle_bias = np.arctan2(tvecs[:, :2], tvecs[:, 2:3])
+    return R_tc, pos_camera, attitude, angle_bias